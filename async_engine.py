@@ -0,0 +1,404 @@
+# async_engine.py
+#
+# asyncio implementation of the listing and download engine, selected with
+# "engine": "async" in config.json. One event loop drives every listing page and
+# download, so thousands of small files can be in flight without a thread each.
+# The loop runs on a thread of its own behind the same interface as
+# zoom_recordings.ThreadEngine, so backup_user and sync_check drive both engines;
+# page bookkeeping (listing.py), the .part files, remote uploads and job
+# bookkeeping (transfers.py) and the rate limit state (request_scheduler.py) are
+# shared with the threaded engine.
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+from request_scheduler import SCHEDULER
+from bandwidth import BANDWIDTH
+from metrics import METRICS
+from storage import StorageError
+from listing import WindowListing
+from transfers import JobPool, new_target, adopt_stored_file, record_transfer, report_transfer
+
+def require_aiohttp():
+    if aiohttp is None:
+        raise RuntimeError("The async engine needs aiohttp, install it with: pip install aiohttp")
+
+class AsyncRequestScheduler:
+    """Awaitable front of a RequestScheduler: the same per-host token bucket, X-RateLimit-* headers and 429 backoff.
+
+    The pacing state lives in the shared scheduler, so configure_requests()
+    applies to both engines and their requests draw from one budget per host.
+    """
+
+    def __init__(self, scheduler=SCHEDULER):
+        self.scheduler = scheduler
+
+    async def request(self, session, method, url, **kwargs):
+        """Send a request, retrying 429s. The caller must release() or read the returned response."""
+        host = urlparse(str(url)).netloc
+        for attempt in range(self.scheduler.max_retries + 1):
+            with METRICS.timer('rate_limit_wait_seconds', host=host):
+                while True:
+                    wait = self.scheduler.reserve(host)
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+            request_start = time.perf_counter()
+            response = await session.request(method, url, **kwargs)
+            METRICS.observe('http_request_seconds', time.perf_counter() - request_start, host=host)
+            self.scheduler.update_from_headers(host, response)
+            if response.status != 429 or attempt == self.scheduler.max_retries:
+                return response
+            response.release()
+            self.scheduler.back_off(host, attempt, response)
+        return response
+
+class AsyncTokens:
+    """Awaitable access to a TokenManager.
+
+    Refreshes are rare and already single-flight (and shared between processes)
+    in TokenManager, so they run on a worker thread instead of blocking the loop.
+    """
+
+    def __init__(self, token_manager):
+        self.token_manager = token_manager
+
+    async def get_token(self):
+        if self.token_manager.expires_soon():
+            return await asyncio.to_thread(self.token_manager.get_token)
+        return self.token_manager.access_token
+
+    async def refresh(self, stale_token=None):
+        return await asyncio.to_thread(self.token_manager.refresh, stale_token)
+
+    def sign_url(self, url, token):
+        return URL(self.token_manager.sign_url(url, token), encoded=True)
+
+def new_session(config, connection_limit):
+    """aiohttp session with the configured timeouts and connection limit."""
+    require_aiohttp()
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=config.get('http_connect_timeout', 10),
+                                    sock_read=config.get('http_read_timeout', 60))
+    connector = aiohttp.TCPConnector(limit=connection_limit, limit_per_host=config.get('max_downloads_per_host', None) or 0)
+    return aiohttp.ClientSession(timeout=timeout, connector=connector, auto_decompress=False)
+
+async def _in_thread(function, *args):
+    """Run a blocking call of a download target on a worker thread.
+
+    If the download is cancelled meanwhile, the call still finishes before the
+    cancellation goes on, so the target is never used by two threads at once.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
+
+async def _throttle(nbytes):
+    # Await the shared bandwidth bucket instead of sleeping on the loop
+    while True:
+        delay = BANDWIDTH.reserve(nbytes)
+        if delay is None:
+            await asyncio.sleep(BANDWIDTH.check_interval)
+            continue
+        if delay > 0:
+            with METRICS.timer('throttle_wait_seconds'):
+                await asyncio.sleep(delay)
+        return
+
+async def _get_download(session, scheduler, tokens, url, headers=None):
+    token = await tokens.get_token()
+    response = await scheduler.request(session, 'GET', tokens.sign_url(url, token), headers=headers or {})
+    if response.status == 401:
+        response.release()
+        METRICS.incr('http_401', endpoint='download')
+        print("Download link rejected the access token, refreshing...")
+        token = await tokens.refresh(stale_token=token)
+        response = await scheduler.request(session, 'GET', tokens.sign_url(url, token), headers=headers or {})
+    return response
+
+async def transfer_recording(session, scheduler, tokens, url, target, buffer_size=1024 * 1024):
+    """asyncio counterpart of zoom_recordings.transfer_recording, with the same resume, checks and retries.
+
+    The target's blocking calls run on worker threads. Returns a
+    DownloadResult(size, sha256) or None if every attempt failed. Cancelling the
+    task leaves the target as an interrupted attempt would.
+    """
+    max_retries = 3
+    retry_delay = 5  # seconds
+    try:
+        for attempt in range(max_retries):
+            start_time = time.time()
+            try:
+                resume_from = await _in_thread(target.resume_offset)
+                response = None
+                if not target.has_all(resume_from):
+                    response = await _get_download(session, scheduler, tokens, url, {'Range': f"bytes={resume_from}-"} if resume_from else None)
+                try:
+                    if response is not None:
+                        if resume_from and response.status == 416:
+                            response.release()
+                            print(f"Server rejected resuming {target.location} at byte {resume_from}, restarting from scratch.")
+                            await _in_thread(target.restart)
+                            resume_from = 0
+                            response = await _get_download(session, scheduler, tokens, url)
+                        response.raise_for_status()
+
+                        if resume_from and response.status != 206:
+                            print(f"Server ignored the Range request for {target.location}, restarting from scratch.")
+                            resume_from = 0
+                        elif resume_from:
+                            print(f"Resuming {target.location} from byte {resume_from}")
+
+                    await _in_thread(target.start, resume_from)
+                    if response is not None and not target.has_all(resume_from):
+                        async for chunk in response.content.iter_chunked(buffer_size):
+                            if BANDWIDTH.limited:
+                                await _throttle(len(chunk))
+                            with METRICS.timer('disk_wait_seconds'):
+                                await _in_thread(target.write, chunk)
+                finally:
+                    if response is not None:
+                        response.release()
+
+                result = await _in_thread(target.finish)
+                report_transfer(target, result, resume_from, time.time() - start_time, attempt + 1)
+                return result
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, StorageError) as e:
+                # Keep the partial data so the next attempt resumes where this one stopped
+                print(f"Error downloading {url}: {e!r}")
+                METRICS.incr('download_seconds', time.time() - start_time)
+                METRICS.incr('download_errors', kind='network')
+                if attempt < max_retries - 1:
+                    METRICS.incr('download_retries')
+                    print(f"Retrying in {retry_delay} seconds...")
+                    await asyncio.sleep(retry_delay)
+                else:
+                    print(f"Failed to download {url} after {max_retries} attempts")
+
+            except ValueError as ve:
+                print(f"Download verification failed: {ve}")
+                METRICS.incr('download_seconds', time.time() - start_time)
+                METRICS.incr('download_errors', kind='verification')
+                if attempt < max_retries - 1:
+                    METRICS.incr('download_retries')
+                await _in_thread(target.keep_for_resume)
+
+        return None
+    finally:
+        await _in_thread(target.abort)
+
+class AsyncDownloadPool(JobPool):
+    """DownloadPool counterpart running the jobs as tasks on the engine's event loop.
+
+    engine.max_in_flight caps the concurrent downloads, per_host_limit the
+    concurrent downloads per host. submit(), wait(), abort() and close() are
+    called from the backup's thread, like DownloadPool's.
+    """
+
+    def __init__(self, engine, manifest=None, per_host_limit=None, max_queued=None):
+        super().__init__(engine.max_in_flight, manifest, max_queued)
+        self.engine = engine
+        self.per_host_limit = per_host_limit
+        self._host_semaphores = {}
+        self.concurrency = f"with {self.max_workers} downloads in flight"
+        engine.call(self._start())
+
+    async def _start(self):
+        # Counts the items on _queue, the workers wait on it instead of the thread-safe queue
+        self._available = asyncio.Semaphore(0)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def _notify(self):
+        self.engine.loop.call_soon_threadsafe(self._available.release)
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            try:
+                _, _, job, future = self._queue.get_nowait()
+            except queue.Empty:
+                # Taken by abort()
+                continue
+            if job is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            downloaded = None
+            try:
+                downloaded = await self._run_job(job)
+            except asyncio.CancelledError:
+                # Aborted, the .part file stays for the next run
+                print(f"Download of {job['local_path']} cancelled, it resumes on the next run.")
+                raise
+            finally:
+                self._job_finished(downloaded)
+                future.set_result(downloaded)
+
+    async def _run_job(self, job):
+        try:
+            # Asking a remote backend whether the file is there is a blocking request
+            if await asyncio.to_thread(adopt_stored_file, job, self.engine.storage, self.manifest):
+                return 0
+
+            # Do not open a connection while the bandwidth schedule pauses downloads
+            while BANDWIDTH.reserve(0) is None:
+                await asyncio.sleep(BANDWIDTH.check_interval)
+
+            target = new_target(job, self.engine.storage, self.engine.preallocate)
+            if self.per_host_limit:
+                host = urlparse(job['url']).netloc
+                semaphore = self._host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+                async with semaphore:
+                    result = await self.engine.transfer(job['url'], target)
+            else:
+                result = await self.engine.transfer(job['url'], target)
+            return record_transfer(job, result, target.location, self.manifest)
+        except Exception as e:
+            print(f"Error processing meeting {job['meeting_uuid']}: {str(e)}")
+            logging.error(f"An error occurred: {e}", exc_info=True)
+            return None
+
+    def abort(self):
+        """Cancel the queued jobs and the running downloads, see JobPool.abort."""
+        super().abort()
+        for worker in self._workers:
+            self.engine.loop.call_soon_threadsafe(worker.cancel)
+
+    async def _join(self):
+        # Only shielded from an interrupted wait, abort() is what cancels the workers
+        await asyncio.wait(self._workers)
+
+    def _join_workers(self):
+        self.engine.call(self._join())
+
+class AsyncEngine:
+    """Runs listings and downloads on an asyncio event loop in a background thread.
+
+    Same interface as zoom_recordings.ThreadEngine: submit_listing(),
+    download_pool() and close(). Everything it needs from the running backup
+    (tokens, API endpoint, storage backend, listing cache and download settings)
+    is passed in, see zoom_recordings.open_engine.
+    """
+
+    def __init__(self, config, token_manager, api_base_url, storage, listing_cache=None, bypass_listing_cache=False,
+                 buffer_size=1024 * 1024, preallocate=False):
+        require_aiohttp()
+        self.config = config
+        self.tokens = AsyncTokens(token_manager)
+        self.api_base_url = api_base_url
+        self.storage = storage
+        self.listing_cache = listing_cache
+        self.bypass_listing_cache = bypass_listing_cache
+        self.buffer_size = buffer_size
+        self.preallocate = preallocate
+        self.max_in_flight = max(1, int(config.get('async_max_downloads', 256)))
+        self.max_concurrent_listings = max(1, int(config.get('max_concurrent_listings', 1)))
+        self.scheduler = AsyncRequestScheduler()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-engine', daemon=True)
+        self._thread.start()
+        self.session, self._listing_slots = self.call(self._open())
+
+    async def _open(self):
+        connection_limit = self.config.get('async_connection_limit', self.max_in_flight + self.max_concurrent_listings)
+        return new_session(self.config, connection_limit), asyncio.Semaphore(self.max_concurrent_listings)
+
+    def call(self, coroutine):
+        """Run coroutine on the loop and wait for its result, cancelling it if the wait is interrupted."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def transfer(self, url, target):
+        return await transfer_recording(self.session, self.scheduler, self.tokens, url, target, self.buffer_size)
+
+    def submit_listing(self, start_date, end_date, page_queue, user_id, stop=None):
+        """List a window on the loop, putting its pages on page_queue followed by None, see zoom_recordings.stream_window.
+
+        Returns a concurrent.futures.Future of the listing's completeness.
+        """
+        return asyncio.run_coroutine_threadsafe(self._stream_window(start_date, end_date, page_queue, user_id, stop), self.loop)
+
+    async def _stream_window(self, start_date, end_date, page_queue, user_id, stop):
+        try:
+            async with self._listing_slots:
+                return await self._list_window(start_date, end_date, page_queue, user_id, stop)
+        finally:
+            page_queue.put(None)
+
+    async def _list_window(self, start_date, end_date, page_queue, user_id, stop):
+        listing = WindowListing(self.api_base_url, user_id, start_date, end_date, self.listing_cache, self.bypass_listing_cache)
+        cached_pages = listing.cached_pages()
+        if cached_pages is not None:
+            for meetings in cached_pages:
+                page_queue.put(meetings)
+            return True
+
+        try:
+            while not listing.done:
+                if stop is not None and stop.is_set():
+                    return False
+                page_start = time.perf_counter()
+                old_token = await self.tokens.get_token()
+                response = await self.scheduler.request(self.session, 'GET', listing.url, params=listing.params,
+                                                        headers={"Authorization": f"Bearer {old_token}"})
+                if response.status == 401:
+                    response.release()
+                    METRICS.incr('http_401', endpoint='recordings')
+                    print("Access token invalid, refreshing...")
+                    new_token = await self.tokens.refresh(stale_token=old_token)
+                    if new_token == old_token:
+                        print("Failed to refresh access token.")
+                        return False
+                    response = await self.scheduler.request(self.session, 'GET', listing.url, params=listing.params,
+                                                            headers={"Authorization": f"Bearer {new_token}"})
+
+                listing.record_page(response.status, time.perf_counter() - page_start)
+                if response.status != 200:
+                    print(f"Error fetching recordings: {response.status} {await response.text()}")
+                    return False
+                meetings = listing.add_page(await response.json())
+                if meetings:
+                    page_queue.put(meetings)
+
+            listing.commit()
+            return True
+        finally:
+            listing.discard()
+
+    def download_pool(self, manifest=None):
+        return AsyncDownloadPool(self, manifest, per_host_limit=self.config.get('max_downloads_per_host', None),
+                                 max_queued=self.config.get('max_queued_downloads', 1000))
+
+    async def _close(self):
+        # Listings stopped by the caller may still be unwinding
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.session.close()
+
+    def close(self):
+        """Close the session and stop the loop, after the download pool is closed."""
+        try:
+            self.call(self._close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
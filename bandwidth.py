@@ -0,0 +1,181 @@
+# bandwidth.py
+
+import os
+import time
+import logging
+import datetime
+import threading
+
+MB = 1024 * 1024
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def _parse_limit(value):
+    """MB/s from the config into bytes/s: None means unlimited, 0 means paused."""
+    if value is None:
+        return None
+    return max(0, int(float(value) * MB))
+
+def _parse_time(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def parse_schedule(config):
+    """Return (default_limit, profiles) from bandwidth_limit and bandwidth_schedule in config.
+
+    Each profile is (days, start_minute, end_minute, limit), with limits in bytes/s.
+    """
+    profiles = []
+    for entry in config.get('bandwidth_schedule', []) or []:
+        days = entry.get('days') or WEEKDAYS
+        if isinstance(days, str):
+            days = [days]
+        days = {day.lower()[:3] for day in days}
+        unknown = days - set(WEEKDAYS)
+        if unknown:
+            raise ValueError(f"Unknown day in bandwidth_schedule: {', '.join(sorted(unknown))}")
+        profiles.append((days, _parse_time(entry.get('from', '00:00')), _parse_time(entry.get('to', '24:00')),
+                         _parse_limit(entry.get('limit'))))
+    return _parse_limit(config.get('bandwidth_limit')), profiles
+
+def limit_at(moment, default_limit, profiles):
+    """The limit of the first profile covering moment (a datetime), else default_limit.
+
+    A profile whose 'to' is earlier than its 'from' runs past midnight, e.g. 22:00-06:00.
+    """
+    minute = moment.hour * 60 + moment.minute
+    weekday = WEEKDAYS[moment.weekday()]
+    for days, start, end, limit in profiles:
+        if start <= end:
+            if weekday in days and start <= minute < end:
+                return limit
+        else:
+            if (weekday in days and minute >= start) or (WEEKDAYS[moment.weekday() - 1] in days and minute < end):
+                return limit
+    return default_limit
+
+def _describe(limit):
+    if limit is None:
+        return "unlimited"
+    if limit == 0:
+        return "paused"
+    return f"{limit / MB:.1f} MB/s"
+
+class BandwidthLimiter:
+    """Token bucket capping the combined throughput of every download in the process.
+
+    The limit follows the time-of-day profiles of the configuration, and is
+    re-evaluated every check_interval seconds. If the configuration file changes
+    on disk it is reloaded, so limits can be changed during a run. A limit of 0
+    pauses downloads until a later profile or edit allows them again.
+    """
+
+    def __init__(self, check_interval=5.0, burst_seconds=1.0):
+        self.check_interval = check_interval
+        self.burst_seconds = burst_seconds
+        self.rate = None
+        self._default_limit = None
+        self._profiles = []
+        self._processes = 1
+        self._config_path = None
+        self._config_mtime = None
+        self._reload = None
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, config, config_path=None, reload=None, processes=1):
+        """Take the limits from config. With config_path and reload (a function returning
+        the parsed config), edits to the file are picked up during the run. processes
+        is the number of processes sharing the limit, each gets an equal part of it."""
+        default_limit, profiles = parse_schedule(config)
+        with self._lock:
+            self._default_limit = default_limit
+            self._profiles = profiles
+            self._processes = max(1, int(processes))
+            self._config_path = config_path
+            self._reload = reload
+            self._config_mtime = self._mtime()
+            self._next_check = 0.0
+        self.refresh()
+
+    def _mtime(self):
+        if not self._config_path:
+            return None
+        try:
+            return os.path.getmtime(self._config_path)
+        except OSError:
+            return None
+
+    def _set_rate(self, rate):
+        # Called with the lock held
+        if rate is not None:
+            rate = rate / self._processes
+        if rate == self.rate:
+            return
+        print(f"Download bandwidth limit is now {_describe(rate)}")
+        logging.info(f"Download bandwidth limit is now {_describe(rate)}")
+        self.rate = rate
+        self._tokens = min(self._tokens, self._burst())
+        self._last_refill = time.monotonic()
+
+    def _burst(self):
+        return max(self.rate * self.burst_seconds, 64 * 1024) if self.rate else 0.0
+
+    def refresh(self):
+        """Reload the configuration file if it changed and apply the limit for the current time."""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            mtime = self._mtime()
+            if self._reload and mtime != self._config_mtime:
+                self._config_mtime = mtime
+                try:
+                    self._default_limit, self._profiles = parse_schedule(self._reload())
+                    print("Configuration changed, bandwidth limits reloaded")
+                except Exception as e:
+                    # Keep the previous limits while the file is being edited
+                    print(f"Could not reload bandwidth limits: {e}")
+                    logging.warning(f"Could not reload bandwidth limits: {e}")
+            self._set_rate(limit_at(datetime.datetime.now(), self._default_limit, self._profiles))
+
+    @property
+    def limited(self):
+        return self.rate is not None
+
+    def reserve(self, nbytes):
+        """Take nbytes from the bucket and return how many seconds the caller must wait before
+        transferring them, or None while downloads are paused (nothing is taken then)."""
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            if self.rate == 0:
+                return None
+            now = time.monotonic()
+            self._tokens = min(self._burst(), self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self._tokens -= nbytes
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, nbytes):
+        """Block until nbytes may be transferred."""
+        while True:
+            delay = self.reserve(nbytes)
+            if delay is None:
+                time.sleep(min(self.check_interval, max(0.0, self._next_check - time.monotonic())) or 0.1)
+                continue
+            if delay > 0:
+                time.sleep(delay)
+            return
+
+    def wait_until_allowed(self, stop=None):
+        """Block while downloads are paused. Returns False if the stop event was set first."""
+        while self.reserve(0) is None:
+            if stop is not None and stop.is_set():
+                return False
+            time.sleep(min(self.check_interval, max(0.0, self._next_check - time.monotonic())) or 0.1)
+        return True
+
+# Shared by every download worker of the process
+BANDWIDTH = BandwidthLimiter()
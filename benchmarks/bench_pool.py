@@ -0,0 +1,121 @@
+# benchmarks/bench_pool.py
+#
+# Runs the download worker pool (plan_downloads + run_download_jobs) against a
+# local file server, once per worker count, and checks every downloaded file
+# byte for byte. Some meetings get restarted 0-minute segments of the same type,
+# which map to the same base name, to make sure concurrent jobs never share a
+# path. Run from the repository root:
+#
+#     python -m benchmarks.bench_pool --meetings 100 --workers 1 4 8
+#     python -m benchmarks.bench_pool --meetings 100 --workers 8 --drop-rate 0.05 --error-rate 0.02
+
+import argparse
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import zoom_recordings
+from benchmarks.fake_zoom_api import make_account
+from benchmarks.file_server import expected_body, start_server
+
+def add_segments(meetings, file_base_url, segments, every=3):
+    # Every few meetings get restarted audio segments of 0 minutes, with different sizes so a mix-up shows
+    for index, meeting in enumerate(meetings):
+        if index % every:
+            continue
+        for segment in range(segments):
+            size = 64 * 1024 + segment * 4099
+            meeting['recording_files'].append({
+                'id': f"{meeting['uuid']}-s{segment}",
+                'recording_start': meeting['start_time'],
+                'recording_end': meeting['start_time'],
+                'file_type': 'M4A',
+                'file_extension': 'M4A',
+                'file_size': size,
+                'recording_type': 'audio_only',
+                'download_url': f"{file_base_url}/{size}/{meeting['uuid']}-s{segment}.m4a",
+            })
+
+def check_files(jobs):
+    """Return (missing, wrong): the local paths of jobs with no file, and with a file that is not the body the server sent."""
+    digests = {}
+    missing = []
+    wrong = []
+    for job in jobs:
+        size = job['expected_size']
+        if size not in digests:
+            digests[size] = hashlib.sha256(expected_body(size)).hexdigest()
+        try:
+            with open(job['local_path'], 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            missing.append(job['local_path'])
+            continue
+        if digest != digests[size]:
+            wrong.append(job['local_path'])
+    return missing, wrong
+
+def run(meetings=100, files=2, file_size_mb=1.0, segments=3, workers=(1, 4, 8), per_host=None, verbose=False, **server_options):
+    file_base_url, server = start_server(**server_options)
+    listing = make_account(file_base_url, users=1, meetings_per_user=meetings, files_per_meeting=files,
+                           file_size=int(file_size_mb * 1024 * 1024))['user0000']
+    add_segments(listing, file_base_url, segments)
+    results = []
+    try:
+        for max_workers in workers:
+            directory = tempfile.mkdtemp(prefix='bench_pool_')
+            try:
+                with open(os.devnull, 'w') as devnull, contextlib.ExitStack() as stack:
+                    if not verbose:
+                        stack.enter_context(contextlib.redirect_stdout(devnull))
+                        stack.enter_context(contextlib.redirect_stderr(devnull))
+                    jobs, planning_failures = zoom_recordings.plan_downloads(listing, directory)
+                    start_time = time.perf_counter()
+                    downloaded_files, failed_files, total_bytes = zoom_recordings.run_download_jobs(jobs, max_workers=max_workers,
+                                                                                                     per_host_limit=per_host)
+                    seconds = time.perf_counter() - start_time
+                missing_files, wrong_files = check_files(jobs)
+                results.append({
+                    'workers': max_workers,
+                    'files': downloaded_files,
+                    'failed': failed_files + planning_failures,
+                    'distinct_paths': len({job['local_path'] for job in jobs}) == len(jobs),
+                    'missing_files': len(missing_files),
+                    'wrong_files': len(wrong_files),
+                    'seconds': round(seconds, 3),
+                    'mb_per_s': round(total_bytes / max(seconds, 1e-9) / (1024 * 1024), 2),
+                })
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        server.terminate()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and check the download worker pool against a local file server")
+    parser.add_argument('--meetings', type=int, default=100)
+    parser.add_argument('--files', type=int, default=2, help="files per meeting")
+    parser.add_argument('--file-size-mb', type=float, default=1.0)
+    parser.add_argument('--segments', type=int, default=3, help="0-minute audio segments added to every third meeting")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help="max_concurrent_downloads values to run")
+    parser.add_argument('--per-host', type=int, default=None, help="max_downloads_per_host")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--bandwidth-mb', type=float, default=None, help="MB/s per download connection")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.meetings, args.files, args.file_size_mb, args.segments, args.workers, args.per_host, args.verbose,
+                  latency=args.latency_ms / 1000, bandwidth=args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None,
+                  error_rate=args.error_rate, drop_rate=args.drop_rate)
+    for result in results:
+        print(f"{result['workers']:3} workers: {result['files']} files, {result['failed']} failed, "
+              f"{result['missing_files']} missing and {result['wrong_files']} wrong on disk, "
+              f"{'distinct' if result['distinct_paths'] else 'SHARED'} paths, {result['seconds']:.2f} s, {result['mb_per_s']:.1f} MB/s")
+    # Failed downloads are missing, but a file that is on disk must be exactly what was served
+    raise SystemExit(0 if all(not result['wrong_files'] and result['distinct_paths'] and result['missing_files'] <= result['failed']
+                              for result in results) else 1)
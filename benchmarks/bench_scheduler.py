@@ -0,0 +1,84 @@
+# benchmarks/bench_scheduler.py
+#
+# Runs the RequestScheduler against the fake Zoom API with its rate limit on:
+# several threads list recordings as fast as they can, once leaving the pacing
+# to 429s and Retry-After and once with the client-side token bucket set to the
+# server's limit. Checks that every request ends in a 200, that every 429 the
+# server sent was retried, and that the paced run stays under the limit. Run
+# from the repository root:
+#
+#     python -m benchmarks.bench_scheduler --requests-per-second 20 --threads 8 --requests 200
+#     python -m benchmarks.bench_scheduler --requests-per-second 20 --throttle-rate 0.05
+
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_zoom_api import make_account, start_api
+from request_scheduler import RequestScheduler
+
+def run(requests_per_second=20.0, burst=None, threads=8, total_requests=200, paced=False, throttle_rate=0.0, verbose=False):
+    api_base_url, api = start_api(make_account('http://127.0.0.1:1', users=1, meetings_per_user=10),
+                                  requests_per_second=requests_per_second, burst=burst, throttle_rate=throttle_rate)
+    scheduler = RequestScheduler(max_retries=10, backoff_max=5.0)
+    host = api_base_url.split('//', 1)[1]
+    if paced:
+        scheduler.set_rate(host, requests_per_second, burst)
+    url = f"{api_base_url}/v2/users/user0000/recordings"
+    headers = {'Authorization': 'Bearer bench'}
+
+    def call(_):
+        response = scheduler.get(url, headers=headers, params={'page_size': 30}, timeout=30)
+        response.close()
+        return response.status_code
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+                stack.enter_context(contextlib.redirect_stderr(devnull))
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                statuses = list(executor.map(call, range(total_requests)))
+            seconds = time.perf_counter() - start_time
+        server = requests.get(f"{api_base_url}/_stats", timeout=10).json()
+    finally:
+        api.terminate()
+    return {
+        'paced': paced,
+        'requests': total_requests,
+        'failed': sum(status != 200 for status in statuses),
+        'server_requests': server['requests'],
+        'server_429s': server['http_429'],
+        'retried_429s': scheduler.stats()[host]['throttled'],
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(total_requests / max(seconds, 1e-9), 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the request scheduler against the rate-limited fake Zoom API")
+    parser.add_argument('--requests-per-second', type=float, default=20.0, help="rate limit the fake API enforces")
+    parser.add_argument('--burst', type=float, default=None)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of requests answered with 429 regardless of the limit")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    results = [run(args.requests_per_second, args.burst, args.threads, args.requests, paced, args.throttle_rate, args.verbose)
+               for paced in (False, True)]
+    for result in results:
+        print(f"{'paced' if result['paced'] else 'unpaced'}: {result['requests']} requests, {result['failed']} failed, "
+              f"{result['server_429s']} 429s from the server, {result['retried_429s']} retried, "
+              f"{result['seconds']:.2f} s, {result['requests_per_second']:.1f} req/s")
+    # Every request must get through and every 429 must have been retried; pacing at the
+    # server's limit only runs into the 429s injected on top of it
+    unpaced, paced = results
+    ok = all(not result['failed'] and result['server_429s'] == result['retried_429s'] for result in results)
+    if not args.throttle_rate:
+        ok = ok and paced['server_429s'] <= max(1, paced['requests'] // 100)
+    raise SystemExit(0 if ok else 1)
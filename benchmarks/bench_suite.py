@@ -0,0 +1,299 @@
+# benchmarks/bench_suite.py
+#
+# End-to-end benchmark of the listing, the downloads and sync_check against a
+# local fake Zoom API and file server, with optional latency, bandwidth caps,
+# 401s, 429s and dropped connections. Prints one JSON object per run so results
+# of different versions can be compared. The storage stage (needs boto3) backs
+# the same account up into benchmarks.fake_s3 and checks every object's size and
+# SHA-256; files over 5 MB go through multipart uploads. Run from the repository root:
+#
+#     python -m benchmarks.bench_suite --meetings 500 --output bench_results.jsonl
+#     python -m benchmarks.bench_suite --meetings 500 --throttle-rate 0.02 --drop-rate 0.01 --compare bench_results.jsonl
+#     python -m benchmarks.bench_suite --stages storage --file-size-mb 12 --drop-rate 0.02 --s3-error-rate 0.02 --s3-drop-rate 0.02
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.corpus import local_file_name, local_folder_name, make_corpus
+from benchmarks.fake_s3 import start_s3
+from benchmarks.fake_zoom_api import make_account, start_api
+from benchmarks.file_server import expected_body, start_server
+from listing import iter_window_listings
+
+STAGES = ['listing', 'download', 'sync_check', 'storage']
+
+# (stage, key, True if higher is better) of the numbers --compare reports
+HEADLINE = [
+    ('listing', 'seconds', False),
+    ('listing', 'meetings_per_second', True),
+    ('download', 'seconds', False),
+    ('download', 'mb_per_s', True),
+    ('sync_check', 'scan_seconds', False),
+    ('sync_check', 'rescan_seconds', False),
+    ('sync_check', 'verify_seconds', False),
+    ('storage', 'seconds', False),
+    ('storage', 'mb_per_s', True),
+]
+
+def code_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def server_stats(base_url):
+    return requests.get(f"{base_url}/_stats", timeout=10).json()
+
+@contextlib.contextmanager
+def quiet(verbose):
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+def _run_metrics(metrics):
+    counters = metrics.summary()['counters']
+    return {name: round(sum(counters.get(name, {}).values())) for name in ('http_401', 'http_429', 'download_retries')}
+
+def bench_listing(zoom_recordings, config, user_id, verbose):
+    from metrics import METRICS
+    windows = zoom_recordings.month_windows(config['start_date'], config['end_date'])
+    METRICS.reset()
+    start_time = time.perf_counter()
+    listings = []
+    with quiet(verbose):
+        max_concurrent_listings = zoom_recordings.configure_requests(config)
+        engine = zoom_recordings.open_engine(config)
+        window_listings = iter_window_listings(engine, windows, user_id, max_concurrent_listings)
+        try:
+            for _, _, pages, listing_future in window_listings:
+                listings.append(([meeting for meetings in pages for meeting in meetings], listing_future.result()))
+        finally:
+            window_listings.close()
+            engine.close()
+    seconds = time.perf_counter() - start_time
+    meetings = sum(len(recordings) for recordings, _ in listings)
+    return dict({
+        'windows': len(windows),
+        'incomplete_windows': sum(1 for _, complete in listings if not complete),
+        'meetings': meetings,
+        'seconds': round(seconds, 3),
+        'meetings_per_second': round(meetings / max(seconds, 1e-9), 1),
+    }, **_run_metrics(METRICS))
+
+def bench_download(zoom_recordings, config, user_id, verbose):
+    from manifest import open_manifest
+    from metrics import METRICS
+    METRICS.reset()
+    start_time = time.perf_counter()
+    with quiet(verbose):
+        zoom_recordings.configure_requests(config)
+        zoom_recordings.configure_downloads(config)
+        manifest = open_manifest(config)
+        try:
+            downloaded_files, failed_files, total_bytes = zoom_recordings.backup_user(config, user_id, manifest)
+        finally:
+            manifest.close()
+    seconds = time.perf_counter() - start_time
+    return dict({
+        'files': downloaded_files,
+        'failed_files': failed_files,
+        'bytes': total_bytes,
+        'seconds': round(seconds, 3),
+        'mb_per_s': round(total_bytes / max(seconds, 1e-9) / (1024 * 1024), 2),
+        'files_per_second': round(downloaded_files / max(seconds, 1e-9), 1),
+    }, **_run_metrics(METRICS))
+
+def check_objects(objects, bucket, prefix, user_id, meetings):
+    """Compare the fake S3's objects with the files of meetings. Returns (missing, wrong) counts."""
+    digests = {}
+    missing = 0
+    wrong = 0
+    for meeting in meetings:
+        folder = local_folder_name(meeting)
+        for file in meeting['recording_files']:
+            size = file['file_size']
+            if size not in digests:
+                digests[size] = hashlib.sha256(expected_body(size)).hexdigest()
+            stored = objects.get(f"{bucket}/{prefix}/{user_id}/{folder}/{local_file_name(file)}")
+            if stored is None:
+                missing += 1
+            elif stored != {'size': size, 'sha256': digests[size]}:
+                wrong += 1
+    return missing, wrong
+
+def bench_storage(zoom_recordings, config, user_id, meetings, s3_endpoint_url, verbose):
+    config = dict(config, storage='s3', s3_bucket='bench', s3_prefix='zoom', s3_endpoint_url=s3_endpoint_url)
+    result = bench_download(zoom_recordings, config, user_id, verbose)
+    objects = requests.get(f"{s3_endpoint_url}/_objects", timeout=10).json()
+    missing, wrong = check_objects(objects, config['s3_bucket'], config['s3_prefix'], user_id, meetings)
+    expected = sum(len(meeting['recording_files']) for meeting in meetings)
+    return dict(result, objects=len(objects), missing=missing, wrong=wrong,
+                correct=len(objects) == expected and not missing and not wrong)
+
+def bench_sync_check(args, directory, verbose):
+    import sync_check
+    base_dir = os.path.join(directory, 'corpus')
+    listing, missing_meetings, mismatched_files = make_corpus(base_dir, meetings=args.corpus_meetings, files_per_meeting=args.files,
+                                                              seed=args.seed)
+    zoom_metadata = sync_check.recording_metadata(listing)
+    cache_path = os.path.join(directory, 'scan_cache.json')
+    with quiet(verbose):
+        start_time = time.perf_counter()
+        local_recordings = sync_check.scan_local_folders(base_dir, cache_path=cache_path)
+        scan_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        sync_check.scan_local_folders(base_dir, cache_path=cache_path)
+        rescan_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        missing, mismatched = sync_check.verify_sync(zoom_metadata, local_recordings)
+        verify_seconds = time.perf_counter() - start_time
+    return {
+        'meetings': len(listing),
+        'scan_seconds': round(scan_seconds, 3),
+        'rescan_seconds': round(rescan_seconds, 3),
+        'verify_seconds': round(verify_seconds, 3),
+        'missing': len(missing),
+        'mismatched': len(mismatched),
+        'correct': len(missing) == missing_meetings and len(mismatched) == mismatched_files,
+    }
+
+def run(args):
+    """Run the selected stages and return the result object."""
+    result = {
+        'version': code_version(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'params': {key: value for key, value in sorted(vars(args).items()) if key not in ('output', 'compare', 'verbose')},
+    }
+    directory = tempfile.mkdtemp(prefix='bench_suite_')
+    processes = []
+    try:
+        if 'listing' in args.stages or 'download' in args.stages or 'storage' in args.stages:
+            file_base_url, file_server = start_server(seed=args.seed, latency=args.file_latency_ms / 1000,
+                                                      bandwidth=args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None,
+                                                      error_rate=args.error_rate, drop_rate=args.drop_rate)
+            processes.append(file_server)
+            account = make_account(file_base_url, users=1, meetings_per_user=args.meetings, files_per_meeting=args.files,
+                                   file_size=int(args.file_size_mb * 1024 * 1024), start_date='2024-01-01', days=args.days, seed=args.seed)
+            api_base_url, api_server = start_api(account, seed=args.seed, latency=args.api_latency_ms / 1000,
+                                                 requests_per_second=args.requests_per_second,
+                                                 unauthorized_rate=args.unauthorized_rate, throttle_rate=args.throttle_rate)
+            processes.append(api_server)
+
+            # zoom_recordings reads its endpoints and credentials when it is imported
+            os.environ.update(ZOOM_API_BASE_URL=f"{api_base_url}/v2", ZOOM_OAUTH_URL=f"{api_base_url}/oauth/token",
+                              USER_ID='user0000', ACCESS_TOKEN='bench-access', REFRESH_TOKEN='bench-refresh',
+                              CLIENT_ID='bench', CLIENT_SECRET='bench')
+            import zoom_recordings
+            # Never write the fake tokens into a real .env
+            zoom_recordings.TOKENS.env_file = None
+
+            config = {
+                'base_dir': os.path.join(directory, 'backup'),
+                'start_date': '2024-01-01',
+                'end_date': (datetime.date(2024, 1, 1) + datetime.timedelta(days=args.days)).strftime("%Y-%m-%d"),
+                'engine': args.engine,
+                'max_concurrent_listings': args.listings,
+                'max_concurrent_downloads': args.downloads,
+                'async_max_downloads': args.downloads,
+                'manifest_path': os.path.join(directory, 'manifest.sqlite'),
+                'listing_cache_dir': os.path.join(directory, 'listing_cache'),
+                'api_requests_per_second': args.client_requests_per_second,
+            }
+            if 'listing' in args.stages:
+                result['listing'] = dict(bench_listing(zoom_recordings, dict(config, use_listing_cache=False), 'user0000', args.verbose),
+                                         api=server_stats(api_base_url))
+            if 'download' in args.stages:
+                result['download'] = dict(bench_download(zoom_recordings, config, 'user0000', args.verbose),
+                                          server=server_stats(file_base_url))
+            if 'storage' in args.stages:
+                s3_endpoint_url, s3_server = start_s3(seed=args.seed, error_rate=args.s3_error_rate, drop_rate=args.s3_drop_rate)
+                processes.append(s3_server)
+                # The fake S3 takes any credentials, boto3 only needs some to sign with
+                os.environ.update(AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1')
+                storage_config = dict(config, manifest_path=os.path.join(directory, 'storage_manifest.sqlite'))
+                result['storage'] = dict(bench_storage(zoom_recordings, storage_config, 'user0000', account['user0000'],
+                                                       s3_endpoint_url, args.verbose),
+                                         server=server_stats(file_base_url), s3=server_stats(s3_endpoint_url))
+        if 'sync_check' in args.stages:
+            result['sync_check'] = bench_sync_check(args, directory, args.verbose)
+    finally:
+        for process in processes:
+            process.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+def load_previous(path):
+    """The last result in a JSON lines file (or a single JSON file)."""
+    with open(path) as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    return json.loads(lines[-1])
+
+def compare(previous, current):
+    print(f"{'':28} {previous.get('version') or '?':>16} {current.get('version') or '?':>16}")
+    for stage, key, higher_is_better in HEADLINE:
+        before = previous.get(stage, {}).get(key)
+        after = current.get(stage, {}).get(key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        print(f"{stage + '.' + key:28} {before:16} {after:16}  {change:+6.1f}%{' (better)' if better and abs(change) >= 5 else ''}")
+    if previous.get('params') != current.get('params'):
+        print("Note: the runs used different parameters")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark listing, downloads and sync_check against a local fake Zoom")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=['listing', 'download', 'sync_check'],
+                        help="storage needs boto3 and is only run when listed")
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads')
+    parser.add_argument('--meetings', type=int, default=300, help="meetings listed and downloaded")
+    parser.add_argument('--files', type=int, default=2, help="files per meeting")
+    parser.add_argument('--file-size-mb', type=float, default=1.0)
+    parser.add_argument('--days', type=int, default=180, help="days the meetings are spread over")
+    parser.add_argument('--corpus-meetings', type=int, default=5000, help="meetings in the sync_check corpus")
+    parser.add_argument('--listings', type=int, default=4, help="max_concurrent_listings")
+    parser.add_argument('--downloads', type=int, default=8, help="max_concurrent_downloads / async_max_downloads")
+    parser.add_argument('--client-requests-per-second', type=float, default=None, help="api_requests_per_second of the client")
+    parser.add_argument('--requests-per-second', type=float, default=None, help="rate limit of the fake API")
+    parser.add_argument('--unauthorized-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--api-latency-ms', type=float, default=0.0)
+    parser.add_argument('--file-latency-ms', type=float, default=0.0)
+    parser.add_argument('--bandwidth-mb', type=float, default=None, help="MB/s per download connection")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--s3-error-rate', type=float, default=0.0, help="share of uploads the fake S3 answers with 500")
+    parser.add_argument('--s3-drop-rate', type=float, default=0.0, help="share of uploads the fake S3 drops unanswered")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="append the result to this JSON lines file")
+    parser.add_argument('--compare', help="compare with the last result in this JSON lines file")
+    parser.add_argument('--verbose', action='store_true', help="show the output of the code under test")
+    args = parser.parse_args()
+
+    previous = load_previous(args.compare) if args.compare else None
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    if previous:
+        compare(previous, result)
+    sys.exit(0 if all(result.get(stage, {}).get('correct', True) for stage in ('sync_check', 'storage')) else 1)
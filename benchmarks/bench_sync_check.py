@@ -0,0 +1,89 @@
+# benchmarks/bench_sync_check.py
+#
+# Compares the old O(N x M) fuzzy scan of verify_sync against the indexed matcher
+# on a synthetic corpus. Run from the repository root:
+#
+#     python -m benchmarks.bench_sync_check --meetings 5000
+
+import argparse
+import datetime
+import random
+import time
+
+from rapidfuzz import fuzz
+
+from sync_check import normalize_string, find_closest_match, build_match_index
+
+TOPICS = ["Math", "Physics", "Chemistry", "Biology", "Coding", "Python", "Scratch", "Robotics",
+          "English", "Spanish", "History", "Geography", "Art", "Music", "Demo", "Review"]
+
+def make_corpus(meetings, seed=0, missing_ratio=0.02, renamed_ratio=0.01):
+    """Build matching (zoom_recordings, local_recordings) dicts keyed by normalized folder name.
+
+    A missing_ratio share of the meetings has no local folder at all, and a
+    renamed_ratio share has a local folder whose topic differs by one character.
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 6, 1, 8, 0)
+    zoom_recordings = {}
+    local_recordings = {}
+    for i in range(meetings):
+        when = start + datetime.timedelta(minutes=30 * rng.randrange(4 * 365 * 48))
+        topic = f"{rng.choice(TOPICS)} {rng.choice(TOPICS)} Batch {rng.randrange(1000)} Class {i}"
+        files = [('MP4', rng.randrange(50, 900) * 1024 * 1024), ('M4A', rng.randrange(5, 90) * 1024 * 1024)]
+        folder_name = normalize_string(f"{topic} {when.strftime('%Y-%m-%d at %H-%M')}")
+        zoom_recordings[folder_name] = {'id': i, 'files': files}
+
+        roll = rng.random()
+        if roll < missing_ratio:
+            continue
+        if roll < missing_ratio + renamed_ratio:
+            topic = topic[:-1] + 'x'
+        local_name = normalize_string(f"{topic} {when.strftime('%Y-%m-%d at %H-%M')}")
+        local_recordings[local_name] = {'files': [(file_type.lower(), size) for file_type, size in files]}
+    return zoom_recordings, local_recordings
+
+def legacy_find_closest_match(folder_name, local_recordings):
+    # The matcher verify_sync used before the index: one fuzz.ratio per local folder
+    highest_ratio = 0
+    best_match = None
+    for local_folder in local_recordings:
+        ratio = fuzz.ratio(folder_name, local_folder)
+        if ratio > highest_ratio:
+            highest_ratio = ratio
+            best_match = local_folder
+    return best_match if round(highest_ratio) >= 99 else None
+
+def run(meetings, seed=0):
+    zoom_recordings, local_recordings = make_corpus(meetings, seed=seed)
+
+    start_time = time.perf_counter()
+    legacy = {name: legacy_find_closest_match(name, local_recordings) for name in zoom_recordings}
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    index = build_match_index(local_recordings)
+    indexed = {name: find_closest_match(name, local_recordings, index) for name in zoom_recordings}
+    indexed_time = time.perf_counter() - start_time
+
+    mismatches = sum(1 for name in zoom_recordings if legacy[name] != indexed[name])
+    return {
+        'meetings': meetings,
+        'local_folders': len(local_recordings),
+        'legacy_seconds': round(legacy_time, 4),
+        'indexed_seconds': round(indexed_time, 4),
+        'speedup': round(legacy_time / max(indexed_time, 1e-9), 1),
+        'different_matches': mismatches,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sync_check folder matching on a synthetic corpus")
+    parser.add_argument('--meetings', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for meetings in args.meetings:
+        result = run(meetings, seed=args.seed)
+        print(f"{result['meetings']:>7} meetings / {result['local_folders']:>7} local folders: "
+              f"legacy {result['legacy_seconds']:.3f}s, indexed {result['indexed_seconds']:.3f}s, "
+              f"speedup {result['speedup']}x, different matches: {result['different_matches']}")
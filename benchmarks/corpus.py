@@ -0,0 +1,78 @@
+# benchmarks/corpus.py
+#
+# Synthetic local backup trees for sync_check: the folders and files a backup of
+# a benchmarks.fake_zoom_api account would leave behind, with a share of meetings
+# missing or with a wrong-sized file. Files are sparse, so a corpus of thousands
+# of multi-GB recordings takes next to no disk space or time to write.
+
+import argparse
+import datetime
+import os
+import random
+
+from benchmarks.fake_zoom_api import make_account
+
+def local_folder_name(meeting):
+    # The folder name plan_downloads gives a meeting
+    formatted_start_time = datetime.datetime.strptime(meeting['start_time'], "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d at %H-%M")
+    return f"{meeting['topic']} {formatted_start_time}".replace(':', '-').replace('/', '-').strip()
+
+def local_file_name(file):
+    # The file name plan_downloads gives a recording file
+    start_time = datetime.datetime.strptime(file['recording_start'], "%Y-%m-%dT%H:%M:%SZ")
+    end_time = datetime.datetime.strptime(file['recording_end'], "%Y-%m-%dT%H:%M:%SZ")
+    duration_in_minutes = int((end_time - start_time).total_seconds() // 60)
+    return f"{file['recording_type'].replace(' ', '_')}_duration_{duration_in_minutes}_minutes.{file['file_extension'].lower()}"
+
+def write_local_tree(meetings, base_dir, user_id='user0000', missing_ratio=0.02, mismatched_ratio=0.01, seed=0):
+    """Write the backup of meetings (a fake_zoom_api user's listing) under base_dir/user_id, as backup_user lays it out.
+
+    Returns (missing_meetings, mismatched_files): the counts a correct
+    verify_sync has to report.
+    """
+    rng = random.Random(seed)
+    missing_meetings = 0
+    mismatched_files = 0
+    for meeting in meetings:
+        roll = rng.random()
+        if roll < missing_ratio:
+            missing_meetings += 1
+            continue
+        folder = os.path.join(base_dir, user_id, local_folder_name(meeting))
+        os.makedirs(folder, exist_ok=True)
+        for index, file in enumerate(meeting['recording_files']):
+            size = file['file_size']
+            if index == 0 and roll < missing_ratio + mismatched_ratio:
+                size = size // 2
+                mismatched_files += 1
+            with open(os.path.join(folder, local_file_name(file)), 'wb') as f:
+                f.truncate(size)
+    return missing_meetings, mismatched_files
+
+def make_corpus(base_dir, meetings=5000, files_per_meeting=2, file_size=200 * 1024 * 1024, days=4 * 365,
+                missing_ratio=0.02, mismatched_ratio=0.01, seed=0):
+    """Generate a one-user account and its local backup under base_dir.
+
+    Returns (meetings, missing_meetings, mismatched_files), meetings being the
+    Zoom listing the local tree should be checked against.
+    """
+    account = make_account('http://127.0.0.1:1', users=1, meetings_per_user=meetings, files_per_meeting=files_per_meeting,
+                           file_size=file_size, start_date='2020-01-01', days=days, seed=seed)
+    listing = account['user0000']
+    missing_meetings, mismatched_files = write_local_tree(listing, base_dir, 'user0000', missing_ratio, mismatched_ratio, seed)
+    return listing, missing_meetings, mismatched_files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic local backup tree for sync_check")
+    parser.add_argument('base_dir')
+    parser.add_argument('--meetings', type=int, default=5000)
+    parser.add_argument('--files', type=int, default=2, help="files per meeting")
+    parser.add_argument('--missing-ratio', type=float, default=0.02)
+    parser.add_argument('--mismatched-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    _, missing_meetings, mismatched_files = make_corpus(args.base_dir, args.meetings, args.files, missing_ratio=args.missing_ratio,
+                                                        mismatched_ratio=args.mismatched_ratio, seed=args.seed)
+    print(f"Wrote {args.meetings - missing_meetings} meeting folders to {args.base_dir}, "
+          f"{missing_meetings} meetings missing, {mismatched_files} files with the wrong size")
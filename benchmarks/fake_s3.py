@@ -0,0 +1,176 @@
+# benchmarks/fake_s3.py
+#
+# Local stand-in for an S3-compatible bucket, enough for "storage": "s3" with
+# s3_endpoint_url pointing at it: path-style HEAD/PUT/DELETE of objects and
+# multipart uploads. Objects are kept as size and SHA-256 only, so large backups
+# need no memory or disk; GET /_objects lists them and GET /_stats counts requests.
+# Upload requests can be failed with a 500, or their connection dropped without
+# an answer, to exercise retries.
+#
+#     python -m benchmarks.fake_s3 --port 9000
+#     (config: "storage": "s3", "s3_bucket": "bench", "s3_endpoint_url": "http://127.0.0.1:9000")
+
+import argparse
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+from benchmarks.file_server import free_port, start_server
+
+class S3Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    error_rate = 0.0        # share of part and object uploads answered with 500
+    drop_rate = 0.0         # share of part and object uploads whose connection is dropped unanswered
+    rng = random.Random(0)
+    objects = {}            # (bucket, key) -> {'size', 'sha256'}
+    uploads = {}            # upload id -> {'bucket', 'key', 'parts': {number: bytes}}
+    stats = {'requests': 0, 'errors': 0, 'drops': 0, 'parts': 0, 'objects': 0, 'aborted': 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        return bucket, urllib.parse.unquote(key), dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def reply(self, status, data=b'', content_type='application/xml', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def not_found(self, code='NoSuchKey'):
+        self.reply(404, f"<Error><Code>{code}</Code></Error>".encode())
+
+    def failed(self):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.count(errors=1)
+            self.reply(500, b"<Error><Code>InternalError</Code></Error>")
+            return True
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            # Hang up after reading the upload, as if the connection was lost before the answer
+            self.count(drops=1)
+            self.close_connection = True
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path in ('/_stats', '/_objects'):
+            with self.lock:
+                data = self.stats if self.path == '/_stats' else {f"{bucket}/{key}": value for (bucket, key), value in self.objects.items()}
+                data = json.dumps(data).encode()
+            self.reply(200, data, 'application/json')
+            return
+        self.reply(501, b"<Error><Code>NotImplemented</Code></Error>")
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse()
+        self.count(requests=1)
+        with self.lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            self.not_found()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(stored['size']))
+        self.send_header('ETag', f'"{stored["sha256"][:32]}"')
+        self.end_headers()
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        self.count(requests=1)
+        data = self.body()
+        if self.failed():
+            return
+        if 'uploadId' in query:
+            with self.lock:
+                upload = self.uploads.get(query['uploadId'])
+                if upload is not None:
+                    upload['parts'][int(query['partNumber'])] = data
+            if upload is None:
+                self.not_found('NoSuchUpload')
+                return
+            self.count(parts=1)
+        else:
+            with self.lock:
+                self.objects[(bucket, key)] = {'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+            self.count(objects=1)
+        self.reply(200, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        self.count(requests=1)
+        self.body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.lock:
+                self.uploads[upload_id] = {'bucket': bucket, 'key': key, 'parts': {}}
+            self.reply(200, (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                             f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode())
+            return
+        with self.lock:
+            upload = self.uploads.pop(query.get('uploadId'), None)
+        if upload is None:
+            self.not_found('NoSuchUpload')
+            return
+        sha256 = hashlib.sha256()
+        size = 0
+        for number in sorted(upload['parts']):
+            sha256.update(upload['parts'][number])
+            size += len(upload['parts'][number])
+        with self.lock:
+            self.objects[(bucket, key)] = {'size': size, 'sha256': sha256.hexdigest()}
+        self.count(objects=1)
+        self.reply(200, (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                         f"<ETag>\"{sha256.hexdigest()[:32]}-{len(upload['parts'])}\"</ETag></CompleteMultipartUploadResult>").encode())
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        self.count(requests=1)
+        with self.lock:
+            if 'uploadId' in query:
+                if self.uploads.pop(query['uploadId'], None) is not None:
+                    self.stats['aborted'] += 1
+            else:
+                self.objects.pop((bucket, key), None)
+        self.reply(204)
+
+def start_s3(port=None, seed=0, **options):
+    """Start the fake S3 in a child process. Returns (endpoint_url, process)."""
+    return start_server(S3Handler, port=port, seed=seed, **options)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for an S3-compatible bucket")
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of uploads answered with 500")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="share of uploads dropped without an answer")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    port = args.port or free_port()
+    endpoint_url, process = start_s3(port, seed=args.seed, error_rate=args.error_rate, drop_rate=args.drop_rate)
+    print(f"Fake S3 listening on {endpoint_url}")
+    try:
+        while process.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        process.terminate()
@@ -0,0 +1,250 @@
+# benchmarks/fake_zoom_api.py
+#
+# Local stand-in for the parts of the Zoom API the backup talks to: GET /v2/users,
+# GET /v2/users/<id>/recordings (paginated, filtered by from/to) and POST
+# /oauth/token. The account is generated from a seed, and its download URLs point
+# at a benchmarks.file_server. Requests are paced by a token bucket answering
+# 429 with Retry-After and X-RateLimit-* headers once it runs dry, and random
+# 401s and 429s can be injected; GET /_stats reports what was served. To run a
+# backup against it:
+#
+#     python -m benchmarks.fake_zoom_api --users 20 --port 8080
+#     ZOOM_API_BASE_URL=http://127.0.0.1:8080/v2 ZOOM_OAUTH_URL=http://127.0.0.1:8080/oauth/token python zoom_recordings.py
+
+import argparse
+import datetime
+import http.server
+import json
+import multiprocessing
+import random
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.file_server import start_server, free_port
+
+def make_account(file_base_url, users=5, meetings_per_user=20, files_per_meeting=2, file_size=1024 * 1024,
+                 start_date='2024-01-01', days=90, seed=1):
+    """Return {user_id: [meeting, ...]} shaped like the Zoom recordings listing."""
+    rng = random.Random(seed)
+    first_day = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    account = {}
+    for u in range(users):
+        user_id = f"user{u:04d}"
+        meetings = []
+        for m in range(meetings_per_user):
+            start = first_day + datetime.timedelta(days=rng.randrange(days), minutes=rng.randrange(24 * 60))
+            end = start + datetime.timedelta(minutes=rng.randrange(5, 120))
+            meeting_uuid = f"{user_id}-m{m:05d}"
+            files = []
+            for f in range(files_per_meeting):
+                files.append({
+                    'id': f"{meeting_uuid}-f{f}",
+                    'recording_start': start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    'recording_end': end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    'file_type': 'MP4',
+                    'file_extension': 'MP4',
+                    'file_size': file_size,
+                    'recording_type': ['shared_screen_with_speaker_view', 'gallery_view', 'active_speaker'][f % 3],
+                    'download_url': f"{file_base_url}/{file_size}/{meeting_uuid}-f{f}.mp4",
+                })
+            meetings.append({
+                'uuid': meeting_uuid,
+                'id': 10000 + m,
+                'topic': f"Class {u} meeting {m}",
+                'start_time': start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'duration': int((end - start).total_seconds() // 60),
+                'recording_count': files_per_meeting,
+                'recording_files': files,
+            })
+        meetings.sort(key=lambda meeting: meeting['start_time'], reverse=True)
+        account[user_id] = meetings
+    return account
+
+class FakeZoomHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    account = {}
+    token_counter = 0
+    token_lock = threading.Lock()
+    latency = 0.0               # seconds before each response
+    requests_per_second = None  # API rate limit, None for unlimited
+    burst = None
+    unauthorized_rate = 0.0     # share of API requests that revoke every token issued so far, answering 401
+    revoked_below = 0           # tokens numbered below this are rejected
+    throttle_rate = 0.0         # share of API requests rejected with 429 regardless of the rate limit
+    rng = random.Random(0)
+    bucket = {'tokens': 0.0, 'last_refill': 0.0}
+    stats = {'requests': 0, 'pages': 0, 'tokens_issued': 0, 'http_401': 0, 'http_429': 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, **values):
+        with self.stats_lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def rate_limit(self):
+        """Take a request from the bucket. Returns (allowed, headers)."""
+        if not self.requests_per_second:
+            return True, {}
+        burst = self.burst or self.requests_per_second
+        with self.stats_lock:
+            now = time.monotonic()
+            bucket = self.bucket
+            bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['last_refill']) * self.requests_per_second)
+            bucket['last_refill'] = now
+            allowed = bucket['tokens'] >= 1
+            if allowed:
+                bucket['tokens'] -= 1
+            remaining = int(bucket['tokens'])
+            wait = (1 - bucket['tokens']) / self.requests_per_second if bucket['tokens'] < 1 else 0.0
+        headers = {'X-RateLimit-Type': 'QPS', 'X-RateLimit-Limit': str(int(burst)), 'X-RateLimit-Remaining': str(remaining)}
+        if remaining == 0:
+            headers['X-RateLimit-Reset'] = f"{wait:.2f}"
+        if not allowed:
+            headers['Retry-After'] = f"{wait:.2f}"
+        return allowed, headers
+
+    def authorized(self):
+        """Apply latency, rate limit and faults. Returns the headers for the answer, or None if one was sent."""
+        self.count(requests=1)
+        if self.latency:
+            time.sleep(self.latency)
+        allowed, headers = self.rate_limit()
+        if not allowed or (self.throttle_rate and self.rng.random() < self.throttle_rate):
+            self.count(http_429=1)
+            headers.setdefault('Retry-After', '1')
+            self.send_json(429, {'code': 429, 'message': "You have reached the maximum per-second rate limit for this API."}, headers)
+            return None
+        authorization = self.headers.get('Authorization', '')
+        if self.unauthorized_rate and self.rng.random() < self.unauthorized_rate:
+            with self.token_lock:
+                FakeZoomHandler.revoked_below = FakeZoomHandler.token_counter + 1
+        # Tokens from /oauth/token are fake-access-<n>, anything else counts as issued before them
+        token_number = authorization.rsplit('-', 1)[-1]
+        token_number = int(token_number) if token_number.isdigit() else 0
+        if not authorization.startswith('Bearer ') or token_number < FakeZoomHandler.revoked_below:
+            self.count(http_401=1)
+            self.send_json(401, {'code': 124, 'message': 'Invalid access token.'}, headers)
+            return None
+        return headers
+
+    def page(self, items, query, key):
+        page_size = min(300, int(query.get('page_size', ['30'])[0]))
+        offset = int(query.get('next_page_token', ['0'])[0] or 0)
+        page_items = items[offset:offset + page_size]
+        next_offset = offset + page_size
+        return {
+            'page_size': page_size,
+            'total_records': len(items),
+            'next_page_token': str(next_offset) if next_offset < len(items) else '',
+            key: page_items,
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if parts == ['_stats']:
+            with self.stats_lock:
+                self.send_json(200, dict(self.stats))
+            return
+        headers = self.authorized()
+        if headers is None:
+            return
+        if parts == ['v2', 'users']:
+            users = [{'id': user_id, 'email': f"{user_id}@example.com", 'status': 'active'} for user_id in sorted(self.account)]
+            self.send_json(200, self.page(users, query, 'users'), headers)
+        elif len(parts) == 4 and parts[:2] == ['v2', 'users'] and parts[3] == 'recordings':
+            meetings = self.account.get(parts[2])
+            if meetings is None:
+                self.send_json(404, {'code': 1001, 'message': 'User does not exist.'}, headers)
+                return
+            date_from = query.get('from', ['0000'])[0][:10]
+            date_to = query.get('to', ['9999'])[0][:10]
+            selected = [meeting for meeting in meetings if date_from <= meeting['start_time'][:10] <= date_to]
+            body = self.page(selected, query, 'meetings')
+            body.update({'from': date_from, 'to': date_to})
+            self.count(pages=1)
+            self.send_json(200, body, headers)
+        else:
+            self.send_json(404, {'code': 404, 'message': 'Not found'}, headers)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlparse(self.path).path != '/oauth/token':
+            self.send_json(404, {'code': 404, 'message': 'Not found'})
+            return
+        with self.token_lock:
+            FakeZoomHandler.token_counter += 1
+            counter = FakeZoomHandler.token_counter
+        self.count(tokens_issued=1)
+        self.send_json(200, {'access_token': f"fake-access-{counter}", 'refresh_token': f"fake-refresh-{counter}",
+                             'token_type': 'bearer', 'expires_in': 3599})
+
+def _serve(port, handler_class, account, ready, options=None, seed=0):
+    handler_class.account = account
+    handler_class.rng = random.Random(seed)
+    for name, value in (options or {}).items():
+        setattr(handler_class, name, value)
+    handler_class.bucket = {'tokens': float(handler_class.burst or handler_class.requests_per_second or 0),
+                            'last_refill': time.monotonic()}
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+    ready.set()
+    server.serve_forever()
+
+def start_api(account, handler_class=FakeZoomHandler, port=None, seed=0, **options):
+    """Serve account with handler_class in a child process. Returns (base_url, process), base_url without /v2.
+
+    options override the handler's latency, requests_per_second, burst, unauthorized_rate and throttle_rate.
+    """
+    port = port or free_port()
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_serve, args=(port, handler_class, account, ready, options, seed), daemon=True)
+    process.start()
+    ready.wait(10)
+    time.sleep(0.1)
+    return f"http://127.0.0.1:{port}", process
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Zoom account and its recording files locally")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--meetings', type=int, default=20, help="meetings per user")
+    parser.add_argument('--files', type=int, default=2, help="files per meeting")
+    parser.add_argument('--file-size', type=int, default=1024 * 1024)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests-per-second', type=float, default=None, help="API rate limit (default: unlimited)")
+    parser.add_argument('--unauthorized-rate', type=float, default=0.0, help="share of API requests answered with 401")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of API requests answered with 429")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0)
+    parser.add_argument('--file-latency-ms', type=float, default=0.0)
+    parser.add_argument('--bandwidth-mb', type=float, default=None, help="MB/s per download connection (default: unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of downloads answered with 503")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="share of downloads cut off part-way")
+    args = parser.parse_args()
+
+    file_base_url, _ = start_server(seed=args.seed, latency=args.file_latency_ms / 1000,
+                                    bandwidth=args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None,
+                                    error_rate=args.error_rate, drop_rate=args.drop_rate)
+    account = make_account(file_base_url, users=args.users, meetings_per_user=args.meetings,
+                           files_per_meeting=args.files, file_size=args.file_size, seed=args.seed)
+    print(f"Serving {args.users} users on http://127.0.0.1:{args.port}/v2, files from {file_base_url}")
+    _serve(args.port, FakeZoomHandler, account, threading.Event(), seed=args.seed,
+           options={'latency': args.api_latency_ms / 1000, 'requests_per_second': args.requests_per_second,
+                    'unauthorized_rate': args.unauthorized_rate, 'throttle_rate': args.throttle_rate})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# benchmarks/file_server.py
+#
+# Local HTTP stand-in for Zoom's recording download URLs. Every path serves a
+# deterministic body of the requested size (/<size>/<name>), with Range support
+# and keep-alive, from a separate process so it does not skew client CPU numbers.
+# Latency, a per-connection bandwidth cap and faults (5xx answers, connections
+# dropped mid-body) can be injected, and GET /_stats reports what was served.
+
+import http.server
+import json
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+
+BLOCK_SIZE = 1024 * 1024
+
+def _block():
+    # Deterministic, incompressible-looking content
+    return bytes((i * 2654435761 >> 13) & 0xFF for i in range(BLOCK_SIZE))
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    block = None
+    latency = 0.0           # seconds before each response
+    bandwidth = None        # bytes per second per connection, None for unlimited
+    error_rate = 0.0        # share of requests answered with 503
+    drop_rate = 0.0         # share of bodies cut off part-way through
+    rng = random.Random(0)
+    stats = {'requests': 0, 'bytes': 0, 'errors': 0, 'drops': 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, **values):
+        with self.stats_lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def send_stats(self):
+        with self.stats_lock:
+            data = json.dumps(self.stats).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            self.send_stats()
+            return
+        match = re.match(r'^/(\d+)/', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        self.count(requests=1)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.count(errors=1)
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        size = int(match.group(1))
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        self.write_body(start, size)
+
+    def write_body(self, start, end):
+        stop = end
+        if self.drop_rate and end > start and self.rng.random() < self.drop_rate:
+            stop = start + self.rng.randrange(end - start)
+        step = 64 * 1024 if self.bandwidth else BLOCK_SIZE
+        began = time.monotonic()
+        position = start
+        while position < stop:
+            offset = position % BLOCK_SIZE
+            chunk = memoryview(self.block)[offset:min(BLOCK_SIZE, offset + stop - position, offset + step)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+            if self.bandwidth:
+                delay = began + (position - start) / self.bandwidth - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        self.count(bytes=position - start)
+        if stop < end:
+            # The client sees a short body and has to resume with a Range request
+            self.count(drops=1)
+            self.close_connection = True
+
+def _serve(port, handler_class, ready, options=None, seed=0):
+    handler_class.block = _block()
+    handler_class.rng = random.Random(seed)
+    for name, value in (options or {}).items():
+        setattr(handler_class, name, value)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+    ready.set()
+    server.serve_forever()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(handler_class=FileHandler, port=None, seed=0, **options):
+    """Start handler_class in a child process. Returns (base_url, process).
+
+    options override the handler's latency, bandwidth, error_rate and drop_rate.
+    """
+    port = port or free_port()
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_serve, args=(port, handler_class, ready, options, seed), daemon=True)
+    process.start()
+    ready.wait(10)
+    time.sleep(0.1)
+    return f"http://127.0.0.1:{port}", process
+
+def expected_body(size):
+    """The bytes a /<size>/... URL serves, for verifying downloads."""
+    block = _block()
+    return (block * (size // BLOCK_SIZE + 1))[:size]
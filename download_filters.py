@@ -0,0 +1,106 @@
+# download_filters.py
+
+import datetime
+
+MB = 1024 * 1024
+
+# Small, critical artifacts first, large alternative camera views last
+DEFAULT_PRIORITY = [
+    'audio_only',
+    'audio_transcript',
+    'closed_caption',
+    'chat_file',
+    'timeline',
+    'poll',
+    'summary',
+    'shared_screen_with_speaker_view',
+    'shared_screen_with_speaker_view(CC)',
+    'active_speaker',
+    'speaker_view',
+    'shared_screen',
+    'shared_screen_with_gallery_view',
+    'gallery_view',
+]
+
+def _lower_set(values):
+    return {value.lower() for value in values or []}
+
+def file_duration_minutes(file):
+    """Length of a recording file in whole minutes, or None if Zoom did not report its start and end."""
+    try:
+        start_time = datetime.datetime.strptime(file['recording_start'], "%Y-%m-%dT%H:%M:%SZ")
+        end_time = datetime.datetime.strptime(file['recording_end'], "%Y-%m-%dT%H:%M:%SZ")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return int((end_time - start_time).total_seconds() // 60)
+
+class DownloadRules:
+    """Which recording files to download, and in which order.
+
+    Include lists are empty to allow everything. Sizes are in bytes and
+    durations in minutes; a file with no reported size or duration passes the
+    corresponding limits. Files are ranked by the position of their
+    recording_type in priority (unlisted types come last) and then by size, so
+    small critical artifacts go before large optional ones.
+    """
+
+    def __init__(self, include_types=None, exclude_types=None, include_extensions=None, exclude_extensions=None,
+                 min_size=None, max_size=None, min_duration=None, max_duration=None, priority=None):
+        self.include_types = _lower_set(include_types)
+        self.exclude_types = _lower_set(exclude_types)
+        self.include_extensions = _lower_set(include_extensions)
+        self.exclude_extensions = _lower_set(exclude_extensions)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        priority = DEFAULT_PRIORITY if priority is None else priority
+        self._ranks = {recording_type.lower(): rank for rank, recording_type in enumerate(priority)}
+
+    def exclusion_reason(self, file, duration_minutes=None):
+        """Return why file is filtered out, or None if it should be downloaded."""
+        recording_type = (file.get('recording_type') or '').lower()
+        extension = (file.get('file_extension') or file.get('file_type') or '').lower()
+        size = file.get('file_size')
+        if duration_minutes is None:
+            duration_minutes = file_duration_minutes(file)
+
+        if self.include_types and recording_type not in self.include_types:
+            return f"recording_type {recording_type} not included"
+        if recording_type in self.exclude_types:
+            return f"recording_type {recording_type} excluded"
+        if self.include_extensions and extension not in self.include_extensions:
+            return f"extension {extension} not included"
+        if extension in self.exclude_extensions:
+            return f"extension {extension} excluded"
+        if size is not None and self.min_size is not None and size < self.min_size:
+            return f"smaller than {self.min_size} bytes"
+        if size is not None and self.max_size is not None and size > self.max_size:
+            return f"larger than {self.max_size} bytes"
+        if duration_minutes is not None and self.min_duration is not None and duration_minutes < self.min_duration:
+            return f"shorter than {self.min_duration} minutes"
+        if duration_minutes is not None and self.max_duration is not None and duration_minutes > self.max_duration:
+            return f"longer than {self.max_duration} minutes"
+        return None
+
+    def accepts(self, file, duration_minutes=None):
+        return self.exclusion_reason(file, duration_minutes) is None
+
+    def priority(self, file):
+        """Sort key for the download queue, lower goes first."""
+        rank = self._ranks.get((file.get('recording_type') or '').lower(), len(self._ranks))
+        return (rank, file.get('file_size') or 0)
+
+def load_download_rules(config):
+    """Build the DownloadRules from the filter and priority settings in config."""
+    min_size_mb = config.get('min_file_size_mb', None)
+    max_size_mb = config.get('max_file_size_mb', None)
+    return DownloadRules(include_types=config.get('include_recording_types', None),
+                         exclude_types=config.get('exclude_recording_types', None),
+                         include_extensions=config.get('include_file_extensions', None),
+                         exclude_extensions=config.get('exclude_file_extensions', None),
+                         min_size=int(min_size_mb * MB) if min_size_mb is not None else None,
+                         max_size=int(max_size_mb * MB) if max_size_mb is not None else None,
+                         min_duration=config.get('min_duration_minutes', None),
+                         max_duration=config.get('max_duration_minutes', None),
+                         priority=config.get('download_priority', None))
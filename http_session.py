@@ -0,0 +1,101 @@
+# http_session.py
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+class _ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def request_sent(self):
+        with self._lock:
+            self.requests += 1
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+_stats = _ConnectionStats()
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _stats.connection_opened()
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _stats.connection_opened()
+        return super()._new_conn()
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with default timeouts that counts requests and newly opened connections."""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        _stats.request_sent()
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+_session = None
+_session_lock = threading.Lock()
+
+def _new_session(pool_size=10, connect_timeout=10, read_timeout=60):
+    session = requests.Session()
+    adapter = _PooledAdapter(timeout=(connect_timeout, read_timeout), pool_connections=10, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def configure_session(pool_size=10, connect_timeout=10, read_timeout=60):
+    """(Re)create the shared keep-alive session.
+
+    pool_size is the number of connections kept open per host, so it should be at
+    least the number of threads talking to one host at the same time.
+    """
+    global _session
+    session = _new_session(pool_size, connect_timeout, read_timeout)
+    with _session_lock:
+        old_session, _session = _session, session
+    if old_session:
+        old_session.close()
+    return session
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session()
+        return _session
+
+def connection_stats():
+    """Return how many requests were sent and how many of them reused an open connection."""
+    with _stats._lock:
+        requests_sent = _stats.requests
+        connections = _stats.connections
+    reused = max(0, requests_sent - connections)
+    return {
+        'requests': requests_sent,
+        'connections_opened': connections,
+        'connections_reused': reused,
+        'reuse_ratio': reused / requests_sent if requests_sent else 0.0,
+    }
+
+def report_connection_stats():
+    stats = connection_stats()
+    message = (f"HTTP connections: {stats['requests']} requests over {stats['connections_opened']} connections, "
+               f"{stats['connections_reused']} reused ({stats['reuse_ratio']:.0%})")
+    print(message)
+    return message
@@ -0,0 +1,169 @@
+# listing.py
+#
+# Month windows and the bookkeeping of listing a window page by page, shared by
+# the threaded engine (zoom_recordings.py) and the async engine (async_engine.py).
+# The engines only send the requests.
+
+import os
+import queue
+import datetime
+import threading
+from dateutil.relativedelta import relativedelta
+from metrics import METRICS
+
+def _month_end(date):
+    """Last day of the calendar month of date (YYYY-MM-DD)."""
+    month_start = datetime.datetime.strptime(date[:8] + '01', "%Y-%m-%d")
+    return (month_start + relativedelta(months=1) - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+def month_windows(start_date, end_date):
+    """Split start_date..end_date (YYYY-MM-DD strings) into consecutive (start, end) windows, one per calendar month.
+
+    Only the first and last windows can be shorter than their month, so runs
+    starting on different dates still list the same months in between.
+    """
+    windows = []
+    while start_date <= end_date:
+        window_end = min(_month_end(start_date), end_date)
+        windows.append((start_date, window_end))
+        start_date = (datetime.datetime.strptime(window_end, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    return windows
+
+def listing_window(start_date, end_date, today=None):
+    """Return the (start, end) actually listed and cached for the window start_date..end_date.
+
+    A window inside one calendar month is widened to that whole month (up to
+    today, for the current month), so the listing is cached under the same key
+    whichever date a run started from, e.g. an incremental run starting at its
+    mark minus the overlap and a sync_check from start_date. Longer windows are
+    listed as they are.
+    """
+    if start_date[:7] != end_date[:7]:
+        return start_date, end_date
+    today = today or datetime.date.today().strftime("%Y-%m-%d")
+    return start_date[:8] + '01', min(_month_end(start_date), max(end_date, today))
+
+def meetings_in_window(meetings, start_date, end_date):
+    """The meetings that started between start_date and end_date, for listings widened by listing_window."""
+    return [meeting for meeting in meetings if start_date <= meeting.get('start_time', '')[:10] <= end_date]
+
+class WindowListing:
+    """State of listing one window of a user's cloud recordings, whichever engine sends the requests.
+
+    The engine first tries cached_pages(). Otherwise it GETs url with params
+    until done, handing each 200 response's JSON to add_page(), and calls
+    commit() at the end and discard() in any case. Pages are staged in the
+    listing cache as they arrive and only committed once the listing is
+    complete. Windows inside one month are listed whole, see listing_window.
+    """
+
+    def __init__(self, api_base_url, user_id, start_date, end_date, cache=None, bypass_cache=False):
+        self.user_id = user_id
+        self.window_start, self.window_end = start_date, end_date
+        self.start_date, self.end_date = listing_window(start_date, end_date)
+        self.widened = (self.start_date, self.end_date) != (start_date, end_date)
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.url = f"{api_base_url}/users/{user_id}/recordings"
+        # Format the dates in the required format (YYYY-MM-DD)
+        self.params = {
+            "from": f"{self.start_date}T00:00:00Z",
+            "to": f"{self.end_date}T23:59:59Z",
+            "page_size": 300  # Maximum page size allowed by the API
+        }
+        self.listing_id = f"{os.getpid()}-{threading.get_ident()}-{id(self)}"
+        self.page_count = 0
+        self.total_meetings = 0
+        self.done = False
+        self._committed = False
+
+    def _in_window(self, meetings):
+        return meetings_in_window(meetings, self.window_start, self.window_end) if self.widened else meetings
+
+    def cached_pages(self):
+        """The meetings of each page of a fresh cached listing, or None if the window has to be listed."""
+        if not self.cache or self.bypass_cache:
+            return None
+        pages = self.cache.load_window(self.user_id, self.start_date, self.end_date)
+        if pages is None:
+            return None
+        print(f"Using cached listing from {self.start_date} to {self.end_date}: {sum(len(page.get('meetings', [])) for page in pages)} meetings")
+        return [meetings for meetings in (self._in_window(page.get('meetings') or []) for page in pages) if meetings]
+
+    def record_page(self, status, seconds):
+        """Count a page request. Page latency includes pacing, 429 backoff and token refreshes."""
+        METRICS.observe('listing_page_seconds', seconds)
+        METRICS.incr('listing_seconds', seconds)
+        METRICS.event('listing_page', user_id=self.user_id, start_date=self.start_date, end_date=self.end_date,
+                      status=status, seconds=round(seconds, 3))
+
+    def add_page(self, data):
+        """Stage a listed page and return its meetings inside the window, setting done after the last page."""
+        print(f"From: {data['from']} To: {data['to']}")
+        print(f"Total Records: {data['total_records']}")
+        meetings = data.get('meetings')
+        if not meetings:
+            print("No meetings found in this time period.")
+            data = dict(data, next_page_token='')
+        if self.cache:
+            self.cache.store_page(self.user_id, self.start_date, self.end_date, self.page_count, data, self.listing_id)
+            self.page_count += 1
+        if not meetings:
+            self.done = True
+            return []
+
+        self.total_meetings += len(meetings)
+        # Check if there are more pages
+        if data.get('next_page_token'):
+            print("Next page token found, fetching next page...")
+            self.params['next_page_token'] = data['next_page_token']
+        else:
+            print("No more pages to fetch.")
+            self.done = True
+        return self._in_window(meetings)
+
+    def commit(self):
+        """Mark the listing complete, committing its pages to the cache."""
+        print("All recordings fetched successfully:")
+        print(f"Total meetings fetched: {self.total_meetings}")
+        if self.cache:
+            self.cache.commit_window(self.user_id, self.start_date, self.end_date, self.page_count, self.listing_id)
+        self._committed = True
+
+    def discard(self):
+        """Drop the staged pages of a listing that did not complete."""
+        if self.cache and not self._committed:
+            self.cache.discard_window(self.user_id, self.start_date, self.end_date, self.listing_id)
+
+def _drain_listings(page_queues, listing_futures, stop):
+    """Cancel listings that have not started, and stop and empty the rest, after the consumer is done."""
+    stop.set()
+    for page_queue, listing_future in zip(page_queues, listing_futures):
+        if listing_future.cancel():
+            continue
+        while not (listing_future.done() and page_queue.empty()):
+            try:
+                page_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def iter_window_listings(engine, windows, user_id, windows_ahead=1):
+    """Yield (window_start, window_end, pages, listing_future) for each of windows, in order.
+
+    engine.submit_listing() starts listing a window as soon as it is within
+    windows_ahead windows of the one being consumed. pages iterates the meetings
+    of each listed page as they arrive, after which listing_future.result() is
+    True if the listing was complete. Close the generator when done, which
+    stops the listings still running.
+    """
+    page_queues = [queue.Queue() for _ in windows]
+    listing_futures = []
+    stop = threading.Event()
+    try:
+        for index, (window_start, window_end) in enumerate(windows):
+            while len(listing_futures) < min(len(windows), index + 1 + windows_ahead):
+                ahead_start, ahead_end = windows[len(listing_futures)]
+                listing_futures.append(engine.submit_listing(ahead_start, ahead_end, page_queues[len(listing_futures)], user_id, stop))
+            yield window_start, window_end, iter(page_queues[index].get, None), listing_futures[index]
+    finally:
+        _drain_listings(page_queues, listing_futures, stop)
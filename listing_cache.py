@@ -0,0 +1,92 @@
+# listing_cache.py
+
+import os
+import re
+import json
+import time
+import glob
+import datetime
+import threading
+
+class ListingCache:
+    """On-disk cache of recordings listing pages, one JSON file per (user, window, page).
+
+    Windows that ended more than settle_days ago are closed and kept for past_ttl
+    seconds; windows reaching into the last settle_days are kept for current_ttl.
+    A window is only served from the cache if every page of it is present and
+    fresh, and only complete listings are stored.
+    """
+
+    def __init__(self, cache_dir, past_ttl=30 * 24 * 3600, current_ttl=15 * 60, settle_days=7):
+        self.cache_dir = cache_dir
+        self.past_ttl = past_ttl
+        self.current_ttl = current_ttl
+        self.settle_days = settle_days
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _prefix(self, user_id, start_date, end_date):
+        safe_user_id = re.sub(r'[^A-Za-z0-9._-]', '_', user_id)
+        return os.path.join(self.cache_dir, f"{safe_user_id}_{start_date}_{end_date}")
+
+    def _page_path(self, user_id, start_date, end_date, page):
+        return f"{self._prefix(user_id, start_date, end_date)}_p{page:04d}.json"
+
+    def ttl_for(self, end_date):
+        settled_before = (datetime.date.today() - datetime.timedelta(days=self.settle_days)).strftime("%Y-%m-%d")
+        return self.past_ttl if end_date < settled_before else self.current_ttl
+
+    def load_window(self, user_id, start_date, end_date):
+        """Return the cached pages of a window, or None if any page is missing or expired."""
+        ttl = self.ttl_for(end_date)
+        pages = []
+        while True:
+            path = self._page_path(user_id, start_date, end_date, len(pages))
+            try:
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if time.time() - entry['fetched_at'] > ttl:
+                return None
+            pages.append(entry['data'])
+            if not entry['data'].get('next_page_token'):
+                return pages
+
+    def store_page(self, user_id, start_date, end_date, page, data, listing_id):
+        """Stage one page of a listing in progress, see commit_window."""
+        path = self._page_path(user_id, start_date, end_date, page)
+        with open(f"{path}.{listing_id}.tmp", 'w') as f:
+            json.dump({'fetched_at': time.time(), 'data': data}, f)
+
+    def commit_window(self, user_id, start_date, end_date, page_count, listing_id):
+        """Replace the cached pages of a window with the page_count pages staged under listing_id."""
+        for page in range(page_count):
+            path = self._page_path(user_id, start_date, end_date, page)
+            os.replace(f"{path}.{listing_id}.tmp", path)
+
+        # Drop pages left over from an earlier, longer listing of the same window
+        for path in glob.glob(f"{glob.escape(self._prefix(user_id, start_date, end_date))}_p*.json"):
+            page = int(path.rsplit('_p', 1)[1][:-len('.json')])
+            if page >= page_count:
+                os.remove(path)
+
+    def discard_window(self, user_id, start_date, end_date, listing_id):
+        """Remove the pages staged under listing_id for an incomplete listing."""
+        for path in glob.glob(f"{glob.escape(self._prefix(user_id, start_date, end_date))}_p*.json.{listing_id}.tmp"):
+            os.remove(path)
+
+    def store_window(self, user_id, start_date, end_date, pages):
+        """Replace the cached pages of a window with a complete listing."""
+        listing_id = f"{os.getpid()}-{threading.get_ident()}"
+        for page, data in enumerate(pages):
+            self.store_page(user_id, start_date, end_date, page, data, listing_id)
+        self.commit_window(user_id, start_date, end_date, len(pages), listing_id)
+
+def open_listing_cache(config):
+    """Return the ListingCache configured in config, or None if it is disabled."""
+    if not config.get('use_listing_cache', True):
+        return None
+    return ListingCache(config.get('listing_cache_dir', 'listing_cache'),
+                        past_ttl=config.get('listing_cache_ttl_past', 30 * 24 * 3600),
+                        current_ttl=config.get('listing_cache_ttl_current', 15 * 60),
+                        settle_days=config.get('listing_cache_settle_days', 7))
@@ -0,0 +1,141 @@
+# manifest.py
+
+import os
+import re
+import json
+import sqlite3
+import datetime
+import threading
+
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+class Manifest:
+    """Local SQLite record of which recording files have already been backed up.
+
+    Rows are keyed by (meeting_uuid, file_id). A single connection is shared by all
+    download workers and guarded by a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS recording_files (
+                    meeting_uuid TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (meeting_uuid, file_id)
+                )
+            """)
+            # Manifests created before checksums were recorded lack the column
+            columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(recording_files)")]
+            if 'sha256' not in columns:
+                self._conn.execute("ALTER TABLE recording_files ADD COLUMN sha256 TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS verified_meetings (
+                    meeting_uuid TEXT PRIMARY KEY,
+                    folder TEXT,
+                    fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    files TEXT NOT NULL,
+                    verified_at TEXT NOT NULL
+                )
+            """)
+
+    def get_file(self, meeting_uuid, file_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM recording_files WHERE meeting_uuid = ? AND file_id = ?",
+                (meeting_uuid, file_id)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def is_completed(self, meeting_uuid, file_id, expected_size=None, path=None):
+        """True if the file was backed up at expected_size and, when path is given, to that path."""
+        entry = self.get_file(meeting_uuid, file_id)
+        if not entry or entry['status'] != STATUS_COMPLETED:
+            return False
+        # A renamed meeting or a changed naming scheme puts the file somewhere else
+        if path is not None and entry['path'] != path:
+            return False
+        # A size change on Zoom's side means the recording was re-processed
+        return not expected_size or entry['size'] == expected_size
+
+    def _record(self, meeting_uuid, file_id, path, size, status, sha256=None):
+        updated_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recording_files (meeting_uuid, file_id, path, size, sha256, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (meeting_uuid, file_id, path, size, sha256, status, updated_at)
+            )
+
+    def mark_completed(self, meeting_uuid, file_id, path, size, sha256=None):
+        """Record a finished file. sha256 is the digest computed while it was streamed to disk."""
+        self._record(meeting_uuid, file_id, path, size, STATUS_COMPLETED, sha256)
+
+    def mark_failed(self, meeting_uuid, file_id, path, size=None):
+        self._record(meeting_uuid, file_id, path, size, STATUS_FAILED)
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    def get_verification(self, meeting_uuid):
+        """The last sync_check result of a meeting, with files decoded, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM verified_meetings WHERE meeting_uuid = ?", (meeting_uuid,)).fetchone()
+        if not row:
+            return None
+        entry = dict(row)
+        entry['files'] = json.loads(entry['files'])
+        return entry
+
+    def mark_verified(self, meeting_uuid, folder, fingerprint, status, files):
+        """Record a sync_check result. files is a list of [file_type, size, file_id, sha256] as checked."""
+        verified_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verified_meetings (meeting_uuid, folder, fingerprint, status, files, verified_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (meeting_uuid, folder, fingerprint, status, json.dumps(files), verified_at)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def open_manifest(config, user_id=None):
+    """Open the manifest configured by 'manifest_path' (default: backup_manifest.sqlite in the working directory).
+
+    With user_id, that user's own manifest next to it is opened instead
+    (backup_manifest.<user_id>.sqlite), so account-wide backups can run users
+    in separate processes.
+    """
+    manifest_path = config.get('manifest_path', 'backup_manifest.sqlite')
+    if user_id:
+        root, extension = os.path.splitext(manifest_path)
+        manifest_path = f"{root}.{re.sub(r'[^A-Za-z0-9._-]', '_', user_id)}{extension}"
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    return Manifest(manifest_path)
@@ -0,0 +1,212 @@
+# metrics.py
+
+import os
+import sys
+import json
+import math
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+def _label_text(label_key):
+    return ','.join(f"{key}={value}" for key, value in label_key)
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class RunMetrics:
+    """Counters, observations and timings of one backup run.
+
+    Counters and observations carry optional labels (e.g. host or
+    recording_type). Observations keep every value, so the summary can report
+    exact percentiles; a run has one per listing page or file, which stays small.
+    Events are appended to events_path as JSON lines when it is set.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events_path = None
+        self.prometheus_path = None
+        self.reset()
+
+    def configure(self, events_path=None, prometheus_path=None):
+        with self._lock:
+            self.events_path = events_path
+            self.prometheus_path = prometheus_path
+        if events_path and os.path.dirname(events_path):
+            os.makedirs(os.path.dirname(events_path), exist_ok=True)
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._counters = {}
+            self._observations = {}
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._observations.setdefault(key, []).append(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Add the time spent in the block to the counter name (in seconds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.incr(name, time.perf_counter() - start, **labels)
+
+    def event(self, kind, **fields):
+        if not self.events_path:
+            return
+        line = json.dumps(dict({'event': kind, 'time': round(time.time(), 3), 'pid': os.getpid()}, **fields)) + '\n'
+        try:
+            with self._lock, open(self.events_path, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            logging.warning(f"Could not write metrics event to {self.events_path}: {e}")
+
+    def snapshot(self):
+        """Raw counters and observations, for merge() in another process."""
+        with self._lock:
+            return {
+                'counters': [(name, list(labels), value) for (name, labels), value in self._counters.items()],
+                'observations': [(name, list(labels), list(values)) for (name, labels), values in self._observations.items()],
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, values in snapshot['observations']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self._observations.setdefault(key, []).extend(values)
+
+    def summary(self):
+        """Return {'counters': {name: {labels: value}}, 'observations': {name: {labels: stats}}}."""
+        with self._lock:
+            counters = dict(self._counters)
+            observations = {key: sorted(values) for key, values in self._observations.items()}
+        result = {'elapsed_seconds': round(time.time() - self.started_at, 3), 'counters': {}, 'observations': {}}
+        for (name, labels), value in sorted(counters.items()):
+            result['counters'].setdefault(name, {})[_label_text(labels)] = round(value, 6)
+        for (name, labels), values in sorted(observations.items()):
+            result['observations'].setdefault(name, {})[_label_text(labels)] = {
+                'count': len(values),
+                'sum': round(sum(values), 6),
+                'p50': percentile(values, 0.50),
+                'p90': percentile(values, 0.90),
+                'p99': percentile(values, 0.99),
+                'max': values[-1],
+            }
+        return result
+
+    def write_prometheus(self, path):
+        """Write the summary in the Prometheus text format, for node_exporter's textfile collector."""
+        summary = self.summary()
+        lines = [f"zoom_backup_elapsed_seconds {summary['elapsed_seconds']}"]
+        for name, series in summary['counters'].items():
+            lines.append(f"# TYPE zoom_backup_{name} counter")
+            for labels, value in series.items():
+                lines.append(f"zoom_backup_{name}{self._prometheus_labels(labels)} {value}")
+        for name, series in summary['observations'].items():
+            lines.append(f"# TYPE zoom_backup_{name} summary")
+            for labels, stats in series.items():
+                for quantile in ('p50', 'p90', 'p99'):
+                    quantile_labels = ','.join(filter(None, [labels, f"quantile=0.{quantile[1:]}"]))
+                    lines.append(f"zoom_backup_{name}{self._prometheus_labels(quantile_labels)} {stats[quantile]}")
+                lines.append(f"zoom_backup_{name}_sum{self._prometheus_labels(labels)} {stats['sum']}")
+                lines.append(f"zoom_backup_{name}_count{self._prometheus_labels(labels)} {stats['count']}")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _prometheus_labels(labels):
+        if not labels:
+            return ''
+        pairs = [label.split('=', 1) for label in labels.split(',')]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+    def report(self):
+        """Print the headline numbers, write the summary event and the Prometheus textfile if configured."""
+        summary = self.summary()
+        counters = summary['counters']
+        observations = summary['observations']
+        throughput = observations.get('download_mb_per_second', {}).get('', {})
+        listing = observations.get('listing_page_seconds', {}).get('', {})
+        print(f"Run metrics: listing {counters.get('listing_seconds', {}).get('', 0):.1f}s over {listing.get('count', 0)} pages "
+              f"(p50 {listing.get('p50') or 0:.2f}s, p99 {listing.get('p99') or 0:.2f}s), "
+              f"downloading {counters.get('download_seconds', {}).get('', 0):.1f}s, "
+              f"waiting on disk {counters.get('disk_wait_seconds', {}).get('', 0):.1f}s, "
+              f"throttled {counters.get('throttle_wait_seconds', {}).get('', 0):.1f}s, "
+              f"per-file MB/s p50 {throughput.get('p50') or 0:.2f} p90 {throughput.get('p90') or 0:.2f}, "
+              f"401s {sum(counters.get('http_401', {}).values()):.0f}, 429s {sum(counters.get('http_429', {}).values()):.0f}, "
+              f"download retries {sum(counters.get('download_retries', {}).values()):.0f}")
+        self.event('summary', **summary)
+        if self.prometheus_path:
+            try:
+                self.write_prometheus(self.prometheus_path)
+            except OSError as e:
+                print(f"Could not write Prometheus metrics to {self.prometheus_path}: {e}")
+                logging.error(f"Could not write Prometheus metrics to {self.prometheus_path}: {e}")
+        return summary
+
+@contextmanager
+def profiled(path=None, top=25):
+    """Run the block under cProfile when path is set, then dump the stats there and print the top entries.
+
+    Threads started inside the block (listing and download workers) are profiled too.
+    """
+    if not path:
+        yield
+        return
+    profilers = [cProfile.Profile()]
+
+    def profile_thread(*args):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ profiles every thread from the first profiler already
+            return
+        profilers.append(profiler)
+
+    threading.setprofile(profile_thread)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        threading.setprofile(None)
+        for profiler in profilers:
+            profiler.disable()
+        stats = pstats.Stats(*profilers)
+        stats.dump_stats(path)
+        print(f"Profile written to {path}, top {top} by cumulative time:")
+        stats.sort_stats('cumulative').print_stats(top)
+
+def configure_metrics(config):
+    """Apply metrics_path and metrics_prometheus_path from config to METRICS."""
+    METRICS.configure(events_path=config.get('metrics_path', None),
+                      prometheus_path=config.get('metrics_prometheus_path', None))
+
+# Shared by the listing, the downloads and the request scheduler
+METRICS = RunMetrics()
@@ -0,0 +1,182 @@
+# request_scheduler.py
+
+import time
+import random
+import logging
+import datetime
+import threading
+import email.utils
+from urllib.parse import urlparse
+from http_session import get_session
+from metrics import METRICS
+
+class _HostState:
+    def __init__(self, requests_per_second=None, burst=None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1.0, requests_per_second or 1.0)
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.limit = None
+        self.remaining = None
+        self.throttled = 0
+
+class RequestScheduler:
+    """Paces requests per host with a token bucket and backs off on 429s.
+
+    The X-RateLimit-Limit/Remaining/Reset headers of every response update the
+    known quota for that host. When the remaining quota hits zero, or the server
+    answers 429, every caller for that host waits until the reset time,
+    Retry-After, or an exponential backoff with jitter has passed.
+
+    reserve(), update_from_headers() and back_off() do not touch the network, so
+    the async engine paces its requests with the same per-host state.
+    """
+
+    def __init__(self, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._hosts = {}
+        self._host_rates = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_retries=None, backoff_base=None, backoff_max=None):
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if backoff_base is not None:
+            self.backoff_base = backoff_base
+        if backoff_max is not None:
+            self.backoff_max = backoff_max
+
+    def set_rate(self, host, requests_per_second, burst=None):
+        """Pace requests to host at requests_per_second (None disables pacing)."""
+        with self._lock:
+            self._host_rates[host] = (requests_per_second, burst)
+            self._hosts[host] = _HostState(requests_per_second, burst)
+
+    def rate(self, host):
+        """The (requests_per_second, burst) configured for host, (None, None) if unpaced."""
+        with self._lock:
+            return self._host_rates.get(host, (None, None))
+
+    def _state(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                requests_per_second, burst = self._host_rates.get(host, (None, None))
+                self._hosts[host] = _HostState(requests_per_second, burst)
+            return self._hosts[host]
+
+    def reserve(self, host):
+        """Take a request from host's bucket. Returns 0, or the seconds to wait before trying again."""
+        state = self._state(host)
+        with self._lock:
+            now = time.monotonic()
+            wait = state.paused_until - now
+            if wait <= 0:
+                if not state.requests_per_second:
+                    return 0
+                state.tokens = min(state.burst, state.tokens + (now - state.last_refill) * state.requests_per_second)
+                state.last_refill = now
+                if state.tokens >= 1:
+                    state.tokens -= 1
+                    return 0
+                wait = (1 - state.tokens) / state.requests_per_second
+            return wait
+
+    def _acquire(self, host):
+        while True:
+            wait = self.reserve(host)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _pause(self, host, delay):
+        state = self._state(host)
+        with self._lock:
+            state.paused_until = max(state.paused_until, time.monotonic() + delay)
+
+    @staticmethod
+    def _parse_delay(value):
+        """Turn a Retry-After / X-RateLimit-Reset value into seconds from now."""
+        if not value:
+            return None
+        value = value.strip()
+        try:
+            number = float(value)
+            # Large values are epoch timestamps, small ones are relative seconds
+            return max(0.0, number - time.time()) if number > 1e9 else max(0.0, number)
+        except ValueError:
+            pass
+        try:
+            moment = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            try:
+                moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                return None
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return max(0.0, (moment - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    def update_from_headers(self, host, response):
+        """Note the quota headers of a response, pausing host once the quota is used up."""
+        state = self._state(host)
+        limit = response.headers.get('X-RateLimit-Limit')
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        with self._lock:
+            if limit is not None and limit.isdigit():
+                state.limit = int(limit)
+            if remaining is not None and remaining.isdigit():
+                state.remaining = int(remaining)
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            reset_delay = self._parse_delay(response.headers.get('X-RateLimit-Reset'))
+            if reset_delay:
+                print(f"Rate limit quota for {host} used up, pausing {reset_delay:.1f} seconds")
+                self._pause(host, reset_delay)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def back_off(self, host, attempt, response):
+        """Pause host after a 429, for Retry-After (plus jitter) or an exponential backoff."""
+        retry_after = self._parse_delay(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 1)
+        else:
+            delay = self._backoff(attempt)
+        self._state(host).throttled += 1
+        METRICS.incr('http_429', host=host)
+        print(f"Rate limited by {host} (429), retrying in {delay:.1f} seconds...")
+        logging.warning(f"Rate limited by {host} (429), retrying in {delay:.1f} seconds")
+        self._pause(host, delay)
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        for attempt in range(self.max_retries + 1):
+            with METRICS.timer('rate_limit_wait_seconds', host=host):
+                self._acquire(host)
+            request_start = time.perf_counter()
+            response = get_session().request(method, url, **kwargs)
+            METRICS.observe('http_request_seconds', time.perf_counter() - request_start, host=host)
+            self.update_from_headers(host, response)
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+            response.close()
+            self.back_off(host, attempt, response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Return {host: {'limit', 'remaining', 'throttled'}} as last seen in response headers."""
+        with self._lock:
+            return {host: {'limit': state.limit, 'remaining': state.remaining, 'throttled': state.throttled}
+                    for host, state in self._hosts.items()}
+
+# Shared by fetch_recordings, refresh_access_token and the downloads
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,423 @@
+# storage.py
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+import requests
+from http_session import get_session
+
+MB = 1024 * 1024
+
+class StorageError(Exception):
+    """A storage backend could not complete a request. Uploads are retried like network errors."""
+
+def object_key(path, root=None):
+    """Turn a local-style path (base_dir/user/meeting/file) into a forward-slash key, relative to root if given."""
+    if root:
+        path = os.path.relpath(path, root)
+    return '/'.join(part for part in re.split(r'[\\/]+', os.path.splitdrive(path)[1]) if part and part not in ('.', '..'))
+
+def is_remote_location(location):
+    """True for the s3:// and gdrive: locations the remote backends record in the manifest."""
+    return location.startswith(('s3://', 'gdrive:'))
+
+class LocalStorage:
+    """Files written to the local filesystem (or a locally synced Drive folder), see download_recording."""
+
+    local = True
+
+    def exists(self, path, size):
+        return os.path.exists(path) and os.path.getsize(path) == size
+
+    def location(self, path):
+        return path
+
+class ChunkedUpload(ABC):
+    """Base of the streaming uploads: write() collects the stream into chunk_size chunks and sends each one.
+
+    Hashes are updated as chunks are sent, so after a failed attempt they match
+    the committed bytes exactly and the download can resume at that offset. At
+    most one chunk plus one write is held in memory.
+    """
+
+    def __init__(self, chunk_size, hashers):
+        self.chunk_size = chunk_size
+        self.hashers = hashers
+        self.committed = 0
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._send(chunk, last=False)
+
+    def _send(self, chunk, last):
+        self._send_chunk(chunk, self.committed, last)
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+        self.committed += len(chunk)
+
+    def resume_offset(self):
+        """Drop the bytes not sent yet and return the offset to resume the download from."""
+        self._buffer.clear()
+        return self.committed
+
+    def finish(self):
+        """Send what is left and complete the upload."""
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        if not self.committed:
+            self._send_whole(chunk)
+            for hasher in self.hashers.values():
+                hasher.update(chunk)
+            self.committed = len(chunk)
+        else:
+            if chunk:
+                self._send(chunk, last=True)
+            self._complete()
+
+    @abstractmethod
+    def _send_chunk(self, chunk, offset, last):
+        """Upload chunk at offset, last being True for the final chunk of a chunked upload."""
+
+    @abstractmethod
+    def _send_whole(self, data):
+        """Upload data as the whole object, for files smaller than one chunk."""
+
+    def _complete(self):
+        pass
+
+    def abort(self):
+        pass
+
+class S3Upload(ChunkedUpload):
+    """Multipart upload, started with the first full chunk. Smaller files are sent with a single put_object."""
+
+    def __init__(self, storage, key, chunk_size, hashers):
+        super().__init__(chunk_size, hashers)
+        self.storage = storage
+        self.key = key
+        self.upload_id = None
+        self.parts = []
+
+    def _call(self, method, **kwargs):
+        try:
+            return getattr(self.storage.client, method)(Bucket=self.storage.bucket, Key=self.key, **kwargs)
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"S3 {method} of {self.key} failed: {e}") from e
+
+    def _send_chunk(self, chunk, offset, last):
+        if self.upload_id is None:
+            self.upload_id = self._call('create_multipart_upload', **self.storage.extra_args)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self._call('upload_part', UploadId=self.upload_id, PartNumber=part_number, Body=chunk)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def _send_whole(self, data):
+        self._call('put_object', Body=data, **self.storage.extra_args)
+
+    def _complete(self):
+        self._call('complete_multipart_upload', UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+        try:
+            self._call('abort_multipart_upload', UploadId=self.upload_id)
+        except StorageError as e:
+            logging.warning(f"Could not abort the multipart upload of {self.key}: {e}")
+        self.upload_id = None
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS, MinIO, ...), uploaded in multipart chunks.
+
+    Credentials come from boto3's usual sources (environment, ~/.aws, instance role).
+    """
+
+    local = False
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, storage_class=None, chunk_size=8 * MB, root=None):
+        if boto3 is None:
+            raise RuntimeError("The s3 storage backend needs boto3, install it with: pip install boto3")
+        # S3 parts other than the last must be at least 5 MiB
+        self.chunk_size = max(5 * MB, chunk_size)
+        self.bucket = bucket
+        self.prefix = object_key(prefix)
+        self.root = root
+        self.extra_args = {'StorageClass': storage_class} if storage_class else {}
+        options = {}
+        if endpoint_url:
+            # S3-compatible services want path-style URLs and often reject the newer default checksum headers
+            options = {'s3': {'addressing_style': 'path'}, 'request_checksum_calculation': 'when_required',
+                       'response_checksum_validation': 'when_required'}
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   config=BotoConfig(retries={'max_attempts': 5, 'mode': 'standard'}, **options))
+
+    def key(self, path):
+        return '/'.join(filter(None, [self.prefix, object_key(path, self.root)]))
+
+    def exists(self, path, size):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise StorageError(f"S3 head_object of {self.key(path)} failed: {e}") from e
+        return response['ContentLength'] == size
+
+    def start_upload(self, path, expected_size, hashers):
+        return S3Upload(self, self.key(path), self.chunk_size, hashers)
+
+    def delete(self, path):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"S3 delete_object of {self.key(path)} failed: {e}") from e
+
+    def location(self, path):
+        return f"s3://{self.bucket}/{self.key(path)}"
+
+GOOGLE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+DRIVE_API_URL = 'https://www.googleapis.com/drive/v3'
+DRIVE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+DRIVE_FOLDER_TYPE = 'application/vnd.google-apps.folder'
+
+class DriveUpload(ChunkedUpload):
+    """Google Drive resumable upload session, opened with the first chunk.
+
+    Chunks are multiples of 256 KiB as Drive requires; the last one completes the file.
+    """
+
+    def __init__(self, storage, parent_id, name, expected_size, chunk_size, hashers):
+        super().__init__(chunk_size, hashers)
+        self.storage = storage
+        self.parent_id = parent_id
+        self.name = name
+        self.expected_size = expected_size
+        self.session_url = None
+        self._completed = False
+
+    def _open_session(self):
+        headers = {'X-Upload-Content-Type': 'application/octet-stream'}
+        if self.expected_size is not None:
+            headers['X-Upload-Content-Length'] = str(self.expected_size)
+        response = self.storage.request('POST', DRIVE_UPLOAD_URL, params={'uploadType': 'resumable', 'supportsAllDrives': 'true'},
+                                        json={'name': self.name, 'parents': [self.parent_id]}, headers=headers)
+        self.session_url = response.headers['Location']
+
+    def _put(self, data, offset, total):
+        if data:
+            content_range = f"bytes {offset}-{offset + len(data) - 1}/{total}"
+        else:
+            content_range = f"bytes */{total}"
+        try:
+            response = get_session().put(self.session_url, data=data, headers={'Content-Range': content_range})
+        except requests.RequestException as e:
+            raise StorageError(f"Drive upload of {self.name} failed: {e}") from e
+        if response.status_code not in (200, 201, 308):
+            raise StorageError(f"Drive upload of {self.name} failed: {response.status_code} {response.text}")
+        return response
+
+    def _send_chunk(self, chunk, offset, last):
+        if self.session_url is None:
+            self._open_session()
+        total = str(offset + len(chunk)) if last else '*'
+        self._put(chunk, offset, total)
+        self._completed = last
+
+    def _send_whole(self, data):
+        self._open_session()
+        self._put(data, 0, str(len(data)))
+
+    def _complete(self):
+        # The stream ended on a chunk boundary, tell Drive the final size
+        if not self._completed:
+            self._put(b'', self.committed, str(self.committed))
+            self._completed = True
+
+    def resume_offset(self):
+        # Drive may have stored part of a chunk whose answer got lost, so ask it where the upload stands
+        offset = super().resume_offset()
+        if self.session_url is None:
+            return offset
+        try:
+            response = get_session().put(self.session_url, headers={'Content-Range': 'bytes */*'})
+        except requests.RequestException as e:
+            raise StorageError(f"Could not query the Drive upload of {self.name}: {e}") from e
+        received = response.headers.get('Range')
+        received = int(received.rsplit('-', 1)[1]) + 1 if received else 0
+        if response.status_code != 308 or received != offset:
+            # The hashes only cover what we know was committed, so start this file over
+            self.abort()
+            self.committed = 0
+            for algorithm in list(self.hashers):
+                self.hashers[algorithm] = hashlib.new(algorithm)
+            return 0
+        return offset
+
+    def abort(self):
+        if self.session_url is None:
+            return
+        try:
+            get_session().delete(self.session_url)
+        except requests.RequestException as e:
+            logging.warning(f"Could not cancel the Drive upload of {self.name}: {e}")
+        self.session_url = None
+
+class DriveStorage:
+    """Files in Google Drive under folder_id, uploaded with resumable upload sessions through requests.
+
+    Meeting folders are created as Drive folders on first use. Authentication uses
+    an OAuth client and refresh token (GDRIVE_CLIENT_ID, GDRIVE_CLIENT_SECRET and
+    GDRIVE_REFRESH_TOKEN in .env) with the drive.file scope or wider.
+    """
+
+    local = False
+
+    def __init__(self, folder_id='root', client_id=None, client_secret=None, refresh_token=None, chunk_size=8 * MB, root=None):
+        if not (client_id and client_secret and refresh_token):
+            raise ValueError("The gdrive storage backend needs GDRIVE_CLIENT_ID, GDRIVE_CLIENT_SECRET and GDRIVE_REFRESH_TOKEN in .env")
+        self.folder_id = folder_id
+        self.root = root
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.chunk_size = max(1, chunk_size // (256 * 1024)) * 256 * 1024
+        self._access_token = None
+        self._expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._folders = {}
+        self._folder_locks = {}
+        self._folders_lock = threading.Lock()
+
+    def _token(self, stale_token=None):
+        with self._token_lock:
+            if self._access_token and self._access_token != stale_token and time.time() < self._expires_at - 60:
+                return self._access_token
+            response = get_session().post(GOOGLE_TOKEN_URL, data={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token,
+                'grant_type': 'refresh_token',
+            })
+            if response.status_code != 200:
+                raise StorageError(f"Could not refresh the Google access token: {response.status_code} {response.text}")
+            token_info = response.json()
+            self._access_token = token_info['access_token']
+            self._expires_at = time.time() + token_info.get('expires_in', 3600)
+            return self._access_token
+
+    def request(self, method, url, **kwargs):
+        """Drive API request with the current token, retried once with a fresh token on 401."""
+        headers = kwargs.pop('headers', {})
+        token = self._token()
+        try:
+            response = get_session().request(method, url, headers=dict(headers, Authorization=f"Bearer {token}"), **kwargs)
+            if response.status_code == 401:
+                token = self._token(stale_token=token)
+                response = get_session().request(method, url, headers=dict(headers, Authorization=f"Bearer {token}"), **kwargs)
+        except requests.RequestException as e:
+            raise StorageError(f"Drive request failed: {e}") from e
+        if response.status_code >= 400:
+            raise StorageError(f"Drive request failed: {response.status_code} {response.text}")
+        return response
+
+    def _find(self, parent_id, name, folder=False):
+        escaped_name = name.replace('\\', '\\\\').replace("'", "\\'")
+        query = f"name = '{escaped_name}' and '{parent_id}' in parents and trashed = false"
+        if folder:
+            query += f" and mimeType = '{DRIVE_FOLDER_TYPE}'"
+        response = self.request('GET', f"{DRIVE_API_URL}/files", params={
+            'q': query, 'fields': 'files(id,size)', 'pageSize': 1,
+            'supportsAllDrives': 'true', 'includeItemsFromAllDrives': 'true',
+        })
+        files = response.json().get('files', [])
+        return files[0] if files else None
+
+    def _folder(self, parts, create=True):
+        # Returns the id of the folder at parts under folder_id, creating missing ones,
+        # or None if one is missing and create is False
+        parent_id = self.folder_id
+        for depth in range(len(parts)):
+            path = tuple(parts[:depth + 1])
+            with self._folders_lock:
+                folder_id = self._folders.get(path)
+                path_lock = self._folder_locks.setdefault(path, threading.Lock())
+            if folder_id is None:
+                # Only this folder's lock is held during the requests, so it is created once
+                with path_lock:
+                    with self._folders_lock:
+                        folder_id = self._folders.get(path)
+                    if folder_id is None:
+                        found = self._find(parent_id, parts[depth], folder=True)
+                        if found:
+                            folder_id = found['id']
+                        elif not create:
+                            return None
+                        else:
+                            response = self.request('POST', f"{DRIVE_API_URL}/files", params={'supportsAllDrives': 'true', 'fields': 'id'},
+                                                    json={'name': parts[depth], 'mimeType': DRIVE_FOLDER_TYPE, 'parents': [parent_id]})
+                            folder_id = response.json()['id']
+                        with self._folders_lock:
+                            self._folders[path] = folder_id
+            parent_id = folder_id
+        return parent_id
+
+    def _lookup(self, path):
+        # The Drive file at path, or None, without creating any folders
+        parts = self.key(path).split('/')
+        parent_id = self._folder(parts[:-1], create=False)
+        return self._find(parent_id, parts[-1]) if parent_id else None
+
+    def key(self, path):
+        return object_key(path, self.root)
+
+    def exists(self, path, size):
+        found = self._lookup(path)
+        return bool(found) and int(found.get('size', -1)) == size
+
+    def start_upload(self, path, expected_size, hashers):
+        parts = self.key(path).split('/')
+        return DriveUpload(self, self._folder(parts[:-1]), parts[-1], expected_size, self.chunk_size, hashers)
+
+    def delete(self, path):
+        found = self._lookup(path)
+        if found:
+            self.request('DELETE', f"{DRIVE_API_URL}/files/{found['id']}", params={'supportsAllDrives': 'true'})
+
+    def location(self, path):
+        return f"gdrive:{self.key(path)}"
+
+def open_storage(config):
+    """Return the storage backend configured by 'storage' (local, s3 or gdrive) in config.
+
+    Remote backends store each file under its path relative to base_dir.
+    """
+    backend = config.get('storage', 'local')
+    root = config.get('base_dir')
+    chunk_size = int(config.get('storage_chunk_size_mb', 8) * MB)
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 's3':
+        return S3Storage(config['s3_bucket'], prefix=config.get('s3_prefix', ''), endpoint_url=config.get('s3_endpoint_url', None),
+                         region=config.get('s3_region', None), storage_class=config.get('s3_storage_class', None), chunk_size=chunk_size,
+                         root=root)
+    if backend == 'gdrive':
+        return DriveStorage(folder_id=config.get('gdrive_folder_id', 'root'), client_id=os.getenv('GDRIVE_CLIENT_ID'),
+                            client_secret=os.getenv('GDRIVE_CLIENT_SECRET'), refresh_token=os.getenv('GDRIVE_REFRESH_TOKEN'),
+                            chunk_size=chunk_size, root=root)
+    raise ValueError(f"Unknown storage backend: {backend}")
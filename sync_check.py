@@ -1,26 +1,29 @@
 # sync_check.py
 
 import os
-from zoom_recordings import fetch_recordings, load_config, encode_credentials, refresh_access_token  # Import the fetch_recordings function from zoom_fetch
+import sys
+import hashlib
+from zoom_recordings import USER_ID, fetch_recordings, load_config, encode_credentials, refresh_access_token, configure_requests, month_windows, open_engine, require_credentials, recording_file_id  # Import the fetch_recordings function from zoom_fetch
 import re
 import datetime
 import time
 from dateutil.relativedelta import relativedelta
 import json
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
 import base64
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from http_session import report_connection_stats
+from manifest import open_manifest, STATUS_COMPLETED
+from storage import is_remote_location
+from download_filters import load_download_rules
+from listing import iter_window_listings
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Retrieve environment variables
-ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
-USER_ID = os.getenv('USER_ID')
-REFRESH_TOKEN = os.getenv('REFRESH_TOKEN')
-CLIENT_ID = os.getenv('CLIENT_ID')
-CLIENT_SECRET = os.getenv('CLIENT_SECRET')
+# Token state lives in zoom_recordings.TOKENS, shared with the downloader
 
 logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -29,8 +32,11 @@ def normalize_string(input_str):
     return re.sub(r'[^a-zA-Z0-9]', '', input_str).lower()
 
 # Fetch Zoom Recording Metadata
-def fetch_zoom_recording_metadata(start_date, end_date):
-    recordings_data = fetch_recordings(start_date, end_date)
+def fetch_zoom_recording_metadata(start_date, end_date, rules=None):
+    return recording_metadata(fetch_recordings(start_date, end_date), rules)
+
+def recording_metadata(recordings_data, rules=None):
+    # Files the download filters exclude are not expected locally
     zoom_recordings = {}
     for recording in recordings_data:
         start_time = recording['start_time']
@@ -38,171 +44,403 @@ def fetch_zoom_recording_metadata(start_date, end_date):
         normalized_folder_name = normalize_string(f"{recording['topic']} {formatted_start_time}")
         zoom_recordings[normalized_folder_name] = {
             'id' : recording['id'],
-            'files': [(file['file_type'], file['file_size']) for file in recording['recording_files']]
+            'uuid': recording['uuid'],
+            'files': [(file['file_type'], file['file_size'], recording_file_id(file)) for file in recording['recording_files']
+                      if not rules or rules.accepts(file)]
         }
     return zoom_recordings
 
+def _list_directory(path, cache, new_cache):
+    """Return (files, subdirs) of path, reusing the cached listing if the folder's mtime did not change.
+
+    A folder's mtime changes whenever an entry is created, renamed or deleted in it,
+    which is how downloads land (written as .part, then renamed into place).
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = cache.get(path)
+    if cached and cached['mtime'] == mtime:
+        files, subdirs = cached['files'], cached['subdirs']
+    else:
+        files = []
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    # On Windows the size comes with the directory listing, no extra stat per file
+                    files.append((os.path.splitext(entry.name)[1][1:], entry.stat().st_size))
+    new_cache[path] = {'mtime': mtime, 'files': files, 'subdirs': subdirs}
+    return files, subdirs
+
+def _scan_tree(path, cache):
+    """Walk path top-down. Returns ([(folder_path, files), ...], new cache entries)."""
+    folders = []
+    new_cache = {}
+    pending = [path]
+    while pending:
+        current = pending.pop(0)
+        try:
+            files, subdirs = _list_directory(current, cache, new_cache)
+        except OSError as e:
+            print(f"Could not scan {current}: {e}")
+            continue
+        folders.append((current, files))
+        pending[0:0] = [os.path.join(current, subdir) for subdir in subdirs]
+    return folders, new_cache
+
+def _load_scan_cache(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_scan_cache(cache_path, cache):
+    with open(cache_path + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(cache_path + '.tmp', cache_path)
+
 # Scan Local Folder Metadata
-def scan_local_folders(base_dir):
+def scan_local_folders(base_dir, cache_path=None, max_workers=8):
+    """Scan base_dir with os.scandir, spread over max_workers workers.
+
+    The top levels (base_dir, then the user folders) are listed here until there
+    are at least max_workers folders left to scan, usually the meeting folders,
+    and each of those is scanned by a worker.
+
+    With cache_path, folder listings are cached by folder mtime so repeat scans only
+    re-read folders that changed.
+    """
+    base_dir = os.path.abspath(base_dir)
+    cache = _load_scan_cache(cache_path)
+    new_cache = {}
+    max_workers = max(1, max_workers)
+
+    files, subdirs = _list_directory(base_dir, cache, new_cache)
+    folders = [(base_dir, files)]
+    pending = [os.path.join(base_dir, subdir) for subdir in subdirs]
+    while pending and len(pending) < max_workers:
+        next_level = []
+        for current in pending:
+            try:
+                files, subdirs = _list_directory(current, cache, new_cache)
+            except OSError as e:
+                print(f"Could not scan {current}: {e}")
+                continue
+            folders.append((current, files))
+            next_level.extend(os.path.join(current, subdir) for subdir in subdirs)
+        pending = next_level
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for subtree_folders, subtree_cache in executor.map(lambda path: _scan_tree(path, cache), pending):
+            folders.extend(subtree_folders)
+            new_cache.update(subtree_cache)
+
+    if cache_path:
+        _save_scan_cache(cache_path, new_cache)
+
     local_recordings = {}
-    for root, dirs, files in os.walk(base_dir):
+    for root, files in folders:
         normalized_folder_name = normalize_string(os.path.basename(root))
         local_recordings[normalized_folder_name] = {
-            'files': [(os.path.splitext(f)[1][1:], os.path.getsize(os.path.join(root, f))) for f in files]
+            'files': [tuple(file) for file in files]
         }
     return local_recordings
 
-def find_closest_match(folder_name, local_recordings):
-    highest_ratio = 0
-    best_match = None
+# Normalized folder names end in the meeting date and time, e.g. "...20240105at1000"
+_DATE_SUFFIX = re.compile(r'(\d{8})at\d{4}$')
 
-    # Iterate over all local recordings
+def build_match_index(local_recordings):
+    """Group local folder names by the date at the end of their normalized name."""
+    index = {}
     for local_folder in local_recordings:
-        # Calculate the similarity ratio between folder_name and each local_folder
-        ratio = fuzz.ratio(folder_name, local_folder)
-
-        # Keep track of the best match with the highest ratio
-        if ratio > highest_ratio:
-            highest_ratio = ratio
-            best_match = local_folder
+        date_match = _DATE_SUFFIX.search(local_folder)
+        index.setdefault(date_match.group(1) if date_match else None, []).append(local_folder)
+    return index
+
+def find_closest_match(folder_name, local_recordings, index=None):
+    # Exact hit on the normalized name is by far the common case
+    if folder_name in local_recordings:
+        return folder_name
+
+    # Otherwise only fuzzy-compare against local folders from the same date
+    date_match = _DATE_SUFFIX.search(folder_name)
+    if index is not None and date_match:
+        candidates = index.get(date_match.group(1), [])
+    else:
+        candidates = list(local_recordings)
+    if not candidates:
+        return None
 
-    # If the best match has a ratio of 99% or more, return it
-    if highest_ratio >= 99:
-        return best_match
+    # Accept the best match only if its similarity rounds to 99% or more
+    best = process.extractOne(folder_name, candidates, scorer=fuzz.ratio, score_cutoff=98.5)
+    if best and round(best[1]) >= 99:
+        return best[0]
     else:
         return None
 
 # Verify Sync Quality
+def verify_meeting(folder_name, zoom_files, local_recordings, match_index=None, margin=0.01):
+    """Compare one meeting's MP4 and M4A files with its local folder.
+
+    Returns (local_folder, mismatched_files), local_folder being None if the
+    meeting has no local folder.
+    """
+    best_match = find_closest_match(folder_name, local_recordings, match_index)
+    if not best_match:
+        return None, []
+
+    # Convert local_files to a dictionary where each file type (e.g., mp4, m4a) has a list of file sizes
+    local_files_dict = {}
+    for file_type, file_size in local_recordings[best_match]['files']:
+        local_files_dict.setdefault(file_type.lower(), []).append(file_size)
+
+    mismatched_files = []
+    for zoom_file in zoom_files['files']:
+        zoom_file_type = zoom_file[0].lower()  # Extracting the file type from the tuple
+        zoom_file_size = zoom_file[1]   # Extracting the file size from the tuple
+        if zoom_file_type not in ['mp4', 'm4a']: #only care about verifying the backup of MP4 and M4A files
+            continue
+        if zoom_file_type not in local_files_dict:
+            mismatched_files.append(f"{zoom_file_type} not found in local folder {best_match}")
+            continue
+
+        # Try to find a matching local file by size, within margin
+        local_files_of_type = local_files_dict[zoom_file_type]
+        for local_file_size in local_files_of_type:
+            if abs(zoom_file_size - local_file_size) / zoom_file_size <= margin:
+                local_files_of_type.remove(local_file_size)  # Remove matched file to prevent reuse
+                break
+        else:
+            mismatched_files.append(f"{best_match} {zoom_file_type} size mismatch: Zoom size {zoom_file_size}, No matching local file")
+    return best_match, mismatched_files
+
 def verify_sync(zoom_recordings, local_recordings, margin=0.01):
     missing_folders = []
     mismatched_files = []
-    
-    try:
-        for folder_name, zoom_files in zoom_recordings.items():
-            best_match = find_closest_match(folder_name, local_recordings)
+    match_index = build_match_index(local_recordings)
+    for folder_name, zoom_files in zoom_recordings.items():
+        best_match, meeting_mismatches = verify_meeting(folder_name, zoom_files, local_recordings, match_index, margin)
+        if not best_match:
+            print(f"Folder {folder_name} not found in Local recordings")
+            missing_folders.append(folder_name)
+        mismatched_files.extend(meeting_mismatches)
+    return missing_folders, mismatched_files
+
+# Strong verification against the checksums recorded while downloading
+def verify_meeting_checksums(folder_name, zoom_files, manifest):
+    """Check one meeting's MP4 and M4A files against the manifest, without reading them back.
+
+    A file passes if the manifest has it completed with a sha256 computed during the
+    download, at exactly Zoom's file_size, and the file on disk still has that size.
+    Files uploaded to remote storage (s3:// or gdrive:) are checked against the
+    manifest only, their size was verified when the upload completed.
+    """
+    failed_files = []
+    for zoom_file_type, zoom_file_size, file_id in zoom_files['files']:
+        zoom_file_type = zoom_file_type.lower()
+        if zoom_file_type not in ['mp4', 'm4a']:
+            continue
+
+        entry = manifest.get_file(zoom_files['uuid'], file_id)
+        if not entry or entry['status'] != STATUS_COMPLETED:
+            failed_files.append(f"{folder_name} {zoom_file_type} is not recorded as backed up in the manifest")
+        elif not entry['sha256']:
+            failed_files.append(f"{folder_name} {zoom_file_type} has no checksum recorded (adopted from disk, not downloaded)")
+        elif entry['size'] != zoom_file_size:
+            failed_files.append(f"{folder_name} {zoom_file_type} size mismatch: Zoom size {zoom_file_size}, backed up size {entry['size']}")
+        elif not is_remote_location(entry['path']):
+            try:
+                local_size = os.path.getsize(entry['path'])
+            except OSError:
+                failed_files.append(f"{folder_name} {zoom_file_type} missing on disk: {entry['path']}")
+                continue
+            if local_size != entry['size']:
+                failed_files.append(f"{folder_name} {zoom_file_type} changed on disk since download: {entry['path']}")
+    return failed_files
+
+def verify_checksums(zoom_recordings, manifest):
+    """Check the MP4 and M4A files of zoom_recordings against the manifest, see verify_meeting_checksums."""
+    failed_files = []
+    for folder_name, zoom_files in zoom_recordings.items():
+        failed_files.extend(verify_meeting_checksums(folder_name, zoom_files, manifest))
+    return failed_files
+
+def meeting_fingerprint(zoom_files, local_files, strong_verify):
+    """Hash of what a meeting was checked against: Zoom's files, the local folder's files and the mode."""
+    data = json.dumps([sorted(json.dumps(list(file)) for file in zoom_files['files']),
+                       sorted(json.dumps(list(file)) for file in local_files or []), bool(strong_verify)])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+class SyncReport:
+    """JSON lines report of a sync check, written and flushed as results come in."""
+
+    def __init__(self, path):
+        self.path = path
+        report_dir = os.path.dirname(path)
+        if report_dir:
+            os.makedirs(report_dir, exist_ok=True)
+        self._file = open(path, 'w')
+
+    def write(self, kind, **fields):
+        self._file.write(json.dumps(dict({'event': kind, 'time': round(time.time(), 3)}, **fields)) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def check_window(zoom_window, local_recordings, match_index, manifest, report, window, strong_verify=False, incremental=False):
+    """Verify the meetings of one listing window, reporting each one. Returns {status: count}.
+
+    Each result is recorded in the manifest; with incremental, meetings that passed
+    before and whose Zoom files and local folder are unchanged are not checked again.
+    """
+    counts = {'ok': 0, 'unchanged': 0, 'missing': 0, 'mismatched': 0, 'unverified': 0, 'errors': 0}
+    for folder_name, zoom_files in zoom_window.items():
+        meeting_uuid = zoom_files['uuid']
+        try:
+            best_match = find_closest_match(folder_name, local_recordings, match_index)
+            local_files = local_recordings[best_match]['files'] if best_match else None
+            fingerprint = meeting_fingerprint(zoom_files, local_files, strong_verify)
+            previous = manifest.get_verification(meeting_uuid) if incremental else None
+            if previous and previous['status'] == 'ok' and previous['fingerprint'] == fingerprint:
+                counts['unchanged'] += 1
+                report.write('meeting', window=window, meeting_uuid=meeting_uuid, folder=folder_name, local_folder=best_match,
+                             status='unchanged', verified_at=previous['verified_at'])
+                continue
 
+            best_match, problems = verify_meeting(folder_name, zoom_files, local_recordings, match_index)
             if not best_match:
-                print(f"Folder {folder_name} not found in Local recordings")
-                missing_folders.append(folder_name)
+                status = 'missing'
+                problems = [f"Folder {folder_name} not found in Local recordings"]
+            elif problems:
+                status = 'mismatched'
             else:
-                local_files = local_recordings[best_match]['files']
-
-                # Convert local_files to a dictionary where each file type (e.g., mp4, m4a) has a list of files
-                local_files_dict = {}
-                for file_type, file_size in local_files:
-                    file_type = file_type.lower()
-                    if file_type not in local_files_dict:
-                        local_files_dict[file_type] = []
-                    local_files_dict[file_type].append({'size': file_size})
-
-                # Iterate over the zoom_files
-                for zoom_file in zoom_files['files']:
-                    try:
-                        zoom_file_type = zoom_file[0].lower()  # Extracting the file type from the tuple
-                        zoom_file_size = zoom_file[1]   # Extracting the file size from the tuple
-
-                        if zoom_file_type in ['mp4', 'm4a']: #only care about verifying the backup of MP4 and M4A files
-                            if zoom_file_type in local_files_dict:  # Ensure there are local files of the same type to compare with
-                                local_files_of_type = local_files_dict[zoom_file_type]
-
-                                # Try to find a matching local file by size
-                                match_found = False
-                                for local_file in local_files_of_type:
-                                    local_file_size = local_file['size']
-
-                                    # Calculate percentage difference
-                                    size_difference = abs(zoom_file_size - local_file_size)
-                                    percentage_difference = size_difference / zoom_file_size
-
-                                    if percentage_difference <= margin:
-                                        match_found = True
-                                        local_files_of_type.remove(local_file)  # Remove matched file to prevent reuse
-                                        break  # Exit the loop once a match is found
-                                
-                                if not match_found:
-                                    mismatched_files.append(f"{best_match} {zoom_file_type} size mismatch: Zoom size {zoom_file_size}, No matching local file")
-                            else:
-                                mismatched_files.append(f"{zoom_file_type} not found in local folder {best_match}")
-                        else:
-                            continue # Skip non-MP4 and M4A files
-
-                    except Exception as e:
-                        print(f"An error occurred while iterating over zoom_files in the verify_sync function: {e}")
-
-        return missing_folders, mismatched_files
-
-    except Exception as e:
-        print(f"An error occurred in the verify_sync function: {e}")
+                status = 'ok'
+            if strong_verify and best_match:
+                strong_problems = verify_meeting_checksums(folder_name, zoom_files, manifest)
+                if strong_problems and status == 'ok':
+                    status = 'unverified'
+                problems.extend(strong_problems)
+
+            files = []
+            for file_type, file_size, file_id in zoom_files['files']:
+                entry = manifest.get_file(meeting_uuid, file_id)
+                files.append([file_type, file_size, file_id, entry['sha256'] if entry else None])
+            manifest.mark_verified(meeting_uuid, best_match, fingerprint, status, files)
+        except Exception as e:
+            counts['errors'] += 1
+            print(f"Error verifying {folder_name}: {e}")
+            logging.error(f"Error verifying {folder_name}: {e}", exc_info=True)
+            report.write('error', window=window, meeting_uuid=meeting_uuid, folder=folder_name, error=repr(e))
+            continue
+
+        counts[status] += 1
+        for problem in problems:
+            print(problem)
+        report.write('meeting', window=window, meeting_uuid=meeting_uuid, folder=folder_name, local_folder=best_match,
+                     status=status, problems=problems, files=files)
+    return counts
 
 # Main Sync Check Logic
 def main_sync_check():
+    """Verify the local backup against Zoom window by window. Returns True if everything checked out."""
+    require_credentials()
+    config = load_config()
+    report = SyncReport(config.get('sync_report_path', 'sync_report.jsonl'))
+    manifest = None
+    start_time = time.time()
+    totals = {'ok': 0, 'unchanged': 0, 'missing': 0, 'mismatched': 0, 'unverified': 0, 'errors': 0}
+    incomplete_windows = 0
     try:
-        config = load_config()
         base_dir = config['base_dir']
         start_date = config['start_date']
-        config_end_date = config['end_date']
         today = datetime.date.today()
+        config_end_date = config.get('end_date') or 'today'
+        if config_end_date == 'today':
+            config_end_date = today.strftime("%Y-%m-%d")
+        strong_verify = config.get('strong_verify', False)
+        incremental = config.get('sync_check_incremental', False)
+        report.write('start', start_date=start_date, end_date=config_end_date, strong_verify=strong_verify, incremental=incremental)
+
+        # Listing concurrency and rate budget
+        max_concurrent_listings = configure_requests(config)
 
-        # Initialize access token timer and refresh frequency
-        access_token_refresh_frequency = config.get('access_token_refresh_frequency', 3500)  # default to 1 hour if not set
-        access_token_elapsed_time = time.time()
+        # Only check the files the backup is configured to download
+        rules = load_download_rules(config)
 
         # Initial access token refresh
         refresh_access_token()
 
-        zoom_recordings = {}
-
-        while True:
-            # Refresh access token if time exceeds the refresh frequency
-            if time.time() - access_token_elapsed_time >= access_token_refresh_frequency:
-                refresh_access_token()
-                access_token_elapsed_time = time.time()
-
-            # Calculate end_date as the earlier of 'start_date + 1 month' and 'config_end_date'
-            calculated_end_date = (datetime.datetime.strptime(start_date, "%Y-%m-%d") + relativedelta(months=1) - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-            end_date = min(calculated_end_date, config_end_date)
-
-            # Print statement for clarity during testing
-            print(f"Fetching recordings from {start_date} to {end_date}")
-
-            piecemal_zoom_recordings = fetch_zoom_recording_metadata(start_date, end_date)
-
-            # No recordings found for this period but continue to the next month
-            if not piecemal_zoom_recordings:
-                print(f"No recordings found from {start_date} to {end_date}, moving to the next month.")
-                start_date = (datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-                if start_date > config_end_date:  # Break if we're past the config's end_date
-                    break
-                continue
-
-            zoom_recordings.update(piecemal_zoom_recordings)
-
-            # Move to the next month
-            start_date = (datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-
-            # Break if we've passed the final end_date from the config
-            if start_date > config_end_date:
-                break
-        
-        local_recordings = scan_local_folders(base_dir)
-        
-        missing_folders, mismatched_files = verify_sync(zoom_recordings, local_recordings)
-        
-        if missing_folders:
-            print(f"Missing folders locally: {missing_folders}")
-        
-        if mismatched_files:
-            print(f"Folders with mismatched files: {mismatched_files}")
-        
-        if not missing_folders and not mismatched_files:
-            print("Local folders are an exact replica of Zoom recordings.")        
-
-        print("All recordings processed and uploaded successfully.")
+        # The local tree is scanned once (and cached by folder mtime), then each window is checked against it
+        local_recordings = scan_local_folders(base_dir,
+                                              cache_path=config.get('scan_cache_path', 'scan_cache.json'),
+                                              max_workers=config.get('scan_workers', 8))
+        match_index = build_match_index(local_recordings)
+        manifest = open_manifest(config)
+
+        # List month windows concurrently with the configured engine, checking each as soon as it is listed
+        windows = month_windows(start_date, config_end_date)
+        engine = open_engine(config)
+        listings = iter_window_listings(engine, windows, USER_ID, max_concurrent_listings)
+        try:
+            for window_start, window_end, pages, listing_future in listings:
+                window = [window_start, window_end]
+                try:
+                    recordings_data = [meeting for meetings in pages for meeting in meetings]
+                    complete = listing_future.result()
+                except Exception as e:
+                    totals['errors'] += 1
+                    incomplete_windows += 1
+                    print(f"Error listing recordings from {window_start} to {window_end}: {e}")
+                    logging.error(f"Error listing recordings from {window_start} to {window_end}: {e}", exc_info=True)
+                    report.write('error', window=window, error=repr(e))
+                    continue
+                if not complete:
+                    incomplete_windows += 1
+                    print(f"Listing from {window_start} to {window_end} is incomplete, only the listed meetings are checked.")
+                    report.write('error', window=window, error="listing incomplete")
+
+                counts = check_window(recording_metadata(recordings_data, rules), local_recordings, match_index, manifest, report, window,
+                                      strong_verify=strong_verify, incremental=incremental)
+                for status, count in counts.items():
+                    totals[status] += count
+                report.write('window', window=window, complete=complete, meetings=len(recordings_data), **counts)
+                if not recordings_data:
+                    print(f"No recordings found from {window_start} to {window_end}, moving to the next month.")
+                else:
+                    print(f"Checked {len(recordings_data)} meetings from {window_start} to {window_end}: {counts['ok']} ok, "
+                          f"{counts['unchanged']} unchanged, {counts['missing']} missing, {counts['mismatched']} mismatched, "
+                          f"{counts['unverified']} failing strong verification, {counts['errors']} errors")
+        finally:
+            listings.close()
+            engine.close()
+
+        report_connection_stats()
 
     except Exception as e:
+        totals['errors'] += 1
         print(f"An error occurred: {e}")
-    
+        logging.error(f"An error occurred: {e}", exc_info=True)
+        report.write('error', error=repr(e))
+    finally:
+        if manifest:
+            manifest.close()
+        report.write('summary', incomplete_windows=incomplete_windows, seconds=round(time.time() - start_time, 3), **totals)
+        report.close()
+
+    problems = totals['missing'] + totals['mismatched'] + totals['unverified'] + totals['errors'] + incomplete_windows
+    print(f"Sync check: {totals['ok']} ok, {totals['unchanged']} unchanged since their last check, {totals['missing']} missing, "
+          f"{totals['mismatched']} with mismatched files, {totals['unverified']} failing strong verification, "
+          f"{totals['errors']} errors, {incomplete_windows} incomplete listings. Report written to {report.path}")
+    if not problems:
+        print("Local folders are an exact replica of Zoom recordings.")
+    return not problems
+
 
 # Example Usage
 if __name__ == "__main__":
-    main_sync_check()
\ No newline at end of file
+    sys.exit(0 if main_sync_check() else 1)
@@ -0,0 +1,178 @@
+# token_manager.py
+
+import time
+import base64
+import logging
+import threading
+from contextlib import contextmanager
+from dotenv import set_key, dotenv_values
+from request_scheduler import SCHEDULER
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on path shared by every process of the backup."""
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after about 10 seconds
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class TokenManager:
+    """Thread-safe holder of the Zoom OAuth access and refresh tokens.
+
+    get_token() refreshes ahead of expiry, based on the expires_in of the last
+    refresh. Concurrent callers share a single refresh: whoever holds the lock
+    refreshes, and the rest pick up the new token once it is released. Zoom
+    rotates the refresh token on every refresh, so the new pair is written back to
+    env_file to survive restarts.
+
+    Several backup processes can share env_file: refreshes take a file lock and
+    first adopt a still-valid token another process already saved there, so the
+    rotating refresh token is only ever used once. With account_id the
+    Server-to-Server OAuth account_credentials grant is used instead, which
+    needs no refresh token at all.
+    """
+
+    def __init__(self, client_id, client_secret, access_token=None, refresh_token=None,
+                 token_url='https://zoom.us/oauth/token', env_file=None,
+                 refresh_margin=300, default_lifetime=3500, account_id=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.env_file = env_file
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.account_id = account_id
+        self._access_token = access_token
+        self._refresh_token = refresh_token
+        # Unknown expiry for a token from .env, refresh before first use
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, refresh_margin=None, default_lifetime=None):
+        if refresh_margin is not None:
+            self.refresh_margin = refresh_margin
+        if default_lifetime is not None:
+            self.default_lifetime = default_lifetime
+
+    @property
+    def access_token(self):
+        return self._access_token
+
+    def _expiring(self):
+        return time.time() >= self._expires_at - self.refresh_margin
+
+    def expires_soon(self):
+        """True if get_token() would refresh before returning."""
+        return self._expiring()
+
+    def get_token(self):
+        """Return a valid access token, refreshing first if it is about to expire."""
+        if self._expiring():
+            with self._lock:
+                if self._expiring():
+                    self._refresh_shared()
+        return self._access_token
+
+    def refresh(self, stale_token=None):
+        """Force a refresh, unless another caller already replaced stale_token. Returns the current token."""
+        with self._lock:
+            if stale_token is None or self._access_token == stale_token:
+                self._refresh_shared(force=stale_token is None)
+        return self._access_token
+
+    def sign_url(self, url, token=None):
+        """Append token (default: the current access token) to a recording download URL."""
+        separator = '&' if '?' in url else '?'
+        return f"{url}{separator}access_token={token or self.get_token()}"
+
+    def _refresh_shared(self, force=False):
+        if not self.env_file:
+            return self._refresh()
+        with _file_lock(f"{self.env_file}.lock"):
+            saved = dotenv_values(self.env_file)
+            if saved.get('REFRESH_TOKEN'):
+                # Always continue from the newest refresh token, even on a forced refresh: older ones are revoked
+                self._refresh_token = saved['REFRESH_TOKEN']
+            if not force and self._adopt_saved_token(saved):
+                return True
+            return self._refresh()
+
+    def _adopt_saved_token(self, saved):
+        """Take over the access token another process saved to env_file, if it is still valid."""
+        try:
+            saved_expires_at = float(saved.get('ACCESS_TOKEN_EXPIRES_AT') or 0)
+        except ValueError:
+            return False
+        saved_token = saved.get('ACCESS_TOKEN')
+        if not saved_token or saved_token == self._access_token or time.time() >= saved_expires_at - self.refresh_margin:
+            return False
+        self._access_token = saved_token
+        self._expires_at = saved_expires_at
+        print("Using the access token refreshed by another backup process")
+        return True
+
+    def _refresh(self):
+        credentials = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode('utf-8')
+        headers = {
+            "Authorization": f"Basic {credentials}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        if self.account_id:
+            token_data = {
+                "grant_type": "account_credentials",
+                "account_id": self.account_id,
+            }
+        else:
+            token_data = {
+                "grant_type": "refresh_token",
+                "refresh_token": self._refresh_token,
+            }
+        response = SCHEDULER.post(self.token_url, headers=headers, data=token_data)
+        if response.status_code != 200:
+            print(f"Error refreshing access token: {response.status_code} {response.text}")
+            logging.error(f"Error refreshing access token: {response.status_code} {response.text}")
+            # Back off from hammering the token endpoint, callers retry with the old token
+            self._expires_at = time.time() + self.refresh_margin + 30
+            return False
+
+        token_info = response.json()
+        self._access_token = token_info['access_token']
+        self._refresh_token = token_info.get('refresh_token', self._refresh_token)
+        self._expires_at = time.time() + token_info.get('expires_in', self.default_lifetime)
+        print("Access Token refreshed successfully")
+        self._persist()
+        return True
+
+    def _persist(self):
+        if not self.env_file:
+            return
+        try:
+            set_key(self.env_file, 'ACCESS_TOKEN', self._access_token)
+            set_key(self.env_file, 'ACCESS_TOKEN_EXPIRES_AT', str(int(self._expires_at)))
+            if self._refresh_token:
+                set_key(self.env_file, 'REFRESH_TOKEN', self._refresh_token)
+        except OSError as e:
+            print(f"Could not save the rotated tokens to {self.env_file}: {e}")
+            logging.error(f"Could not save the rotated tokens to {self.env_file}: {e}")
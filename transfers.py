@@ -0,0 +1,429 @@
+# transfers.py
+#
+# The parts of a download that do not depend on how the bytes arrive, shared by
+# the threaded engine (zoom_recordings.py) and the async engine (async_engine.py):
+# the .part file state machine, streaming into remote storage, and the
+# bookkeeping of download jobs. Nothing here talks to Zoom.
+
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import Future, as_completed
+from metrics import METRICS
+
+# Persist .part progress at most once per this many bytes
+PART_PROGRESS_INTERVAL = 8 * 1024 * 1024
+
+DownloadResult = namedtuple('DownloadResult', ['size', 'sha256'])
+
+class DownloadCancelled(Exception):
+    """Raised inside a download when its pool is aborted, see JobPool.abort."""
+
+def _discard_partial_download(part_file):
+    for path in (part_file, part_file + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _save_part_progress(part_file, expected_size, bytes_written):
+    progress_file = part_file + '.json'
+    with open(progress_file + '.tmp', 'w') as f:
+        json.dump({'expected_size': expected_size, 'bytes_written': bytes_written}, f)
+    os.replace(progress_file + '.tmp', progress_file)
+
+def _load_part_progress(part_file, expected_size):
+    """Return the byte offset to resume part_file from, discarding it if it belongs to a different file."""
+    progress_file = part_file + '.json'
+    if not os.path.exists(part_file):
+        _discard_partial_download(part_file)
+        return 0
+
+    bytes_written = os.path.getsize(part_file)
+    if os.path.exists(progress_file):
+        try:
+            with open(progress_file, 'r') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            progress = {}
+        if progress.get('expected_size') != expected_size:
+            print(f"Partial download {part_file} does not match the expected size anymore, restarting.")
+            _discard_partial_download(part_file)
+            return 0
+        # Preallocated files are full size from the start, so the sidecar is what counts
+        bytes_written = min(bytes_written, progress.get('bytes_written', 0))
+
+    if expected_size and bytes_written > expected_size:
+        _discard_partial_download(part_file)
+        return 0
+    return bytes_written
+
+def _new_hashers(expected_checksums=None):
+    hashers = {'sha256': hashlib.sha256()}
+    for algorithm in (expected_checksums or {}):
+        hashers.setdefault(algorithm, hashlib.new(algorithm))
+    return hashers
+
+def _hash_existing(part_file, length, hashers):
+    """Feed the first length bytes already in part_file to hashers, so a resumed download hashes the whole file."""
+    with open(part_file, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            for hasher in hashers.values():
+                hasher.update(block)
+            remaining -= len(block)
+
+def _verify_checksums(hashers, expected_checksums):
+    digests = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    for algorithm, expected_digest in (expected_checksums or {}).items():
+        if digests[algorithm] != expected_digest.lower():
+            raise ValueError(f"{algorithm} checksum {digests[algorithm]} does not match expected {expected_digest}")
+    return digests
+
+class PartFile:
+    """Download target writing to <file_name>.part, renamed into place once complete.
+
+    An engine asks resume_offset() where to resume, calls start() with the
+    offset the server actually honoured, feeds the body to write() and calls
+    finish(), which verifies the size and checksums. A <name>.part.json sidecar
+    records how much of the .part file is real data, so an interrupted download
+    resumes from there on the next attempt or the next run.
+    """
+
+    verb = 'Downloaded'
+
+    def __init__(self, file_name, expected_size=None, expected_checksums=None, preallocate=False):
+        self.file_name = file_name
+        self.part_file = file_name + '.part'
+        self.location = file_name
+        self.expected_size = expected_size
+        self.expected_checksums = expected_checksums
+        self.preallocate = preallocate
+        self.hashers = None
+        self.size = 0
+        self._saved_size = 0
+        self._file = None
+
+    def resume_offset(self):
+        """The byte offset to request the body from."""
+        self.close()
+        return _load_part_progress(self.part_file, self.expected_size)
+
+    def has_all(self, offset):
+        """True if a previous attempt already fetched every byte and only the rename is missing."""
+        return bool(self.expected_size) and offset == self.expected_size
+
+    def restart(self):
+        """Drop the partial data, after the server rejected resuming it."""
+        self.close()
+        _discard_partial_download(self.part_file)
+
+    def start(self, offset):
+        """Continue at offset (0 to start over), hashing the bytes already on disk first."""
+        self.hashers = _new_hashers(self.expected_checksums)
+        if offset:
+            _hash_existing(self.part_file, offset, self.hashers)
+        self.size = self._saved_size = offset
+        if self.has_all(offset):
+            return
+        _save_part_progress(self.part_file, self.expected_size, offset)
+        self._file = open(self.part_file, 'r+b' if offset else 'wb')
+        self._file.seek(offset)
+        if self.preallocate and self.expected_size:
+            # Reserve the whole file up front, .part.json tracks how much of it is real data
+            if os.path.getsize(self.part_file) < self.expected_size:
+                self._file.truncate(self.expected_size)
+        else:
+            self._file.truncate()
+
+    def write(self, data):
+        self._file.write(data)
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+        if self.size - self._saved_size >= PART_PROGRESS_INTERVAL:
+            self._file.flush()
+            _save_part_progress(self.part_file, self.expected_size, self.size)
+            self._saved_size = self.size
+
+    def close(self):
+        """Close the .part file after an attempt, recording how much of it was written."""
+        if self._file is None:
+            return
+        try:
+            if self.preallocate and self.expected_size and self.size < self.expected_size:
+                self._file.truncate(self.size)
+        finally:
+            self._file.close()
+            self._file = None
+        _save_part_progress(self.part_file, self.expected_size, self.size)
+
+    def finish(self):
+        """Verify the download and move it into place. Returns a DownloadResult, raises ValueError on a mismatch."""
+        self.close()
+        if self.expected_size and self.size != self.expected_size:
+            raise ValueError(f"Downloaded size {self.size} does not match expected size {self.expected_size}")
+        digests = _verify_checksums(self.hashers, self.expected_checksums)
+        # Only move the file into place once it is complete
+        os.replace(self.part_file, self.file_name)
+        _discard_partial_download(self.part_file)
+        return DownloadResult(self.size, digests['sha256'])
+
+    def keep_for_resume(self):
+        """After a failed verification: keep a short download to resume it, drop anything else. Returns True if kept."""
+        self.close()
+        if self.expected_size and self.size < self.expected_size:
+            return True
+        _discard_partial_download(self.part_file)
+        return False
+
+    def abort(self):
+        """Stop for now, keeping the .part file for the next run."""
+        self.close()
+
+class UploadTarget:
+    """Download target streaming straight into a storage backend's chunked upload, without a local copy.
+
+    Same interface as PartFile. The upload's hashes only cover the chunks the
+    backend committed, so after a failed attempt the download resumes at the
+    last committed chunk.
+    """
+
+    verb = 'Uploaded'
+
+    def __init__(self, storage, path, expected_size=None, expected_checksums=None):
+        self.storage = storage
+        self.path = path
+        self.location = storage.location(path)
+        self.expected_size = expected_size
+        self.expected_checksums = expected_checksums
+        self.size = 0
+        self._upload = None
+
+    def resume_offset(self):
+        if self._upload is None:
+            self._upload = self.storage.start_upload(self.path, self.expected_size, _new_hashers(self.expected_checksums))
+        return self._upload.resume_offset()
+
+    def has_all(self, offset):
+        return bool(self.expected_size) and offset == self.expected_size
+
+    def restart(self):
+        # The committed chunks cannot be reused, start a new upload
+        self.abort()
+        self._upload = self.storage.start_upload(self.path, self.expected_size, _new_hashers(self.expected_checksums))
+
+    def start(self, offset):
+        if not offset and self._upload.committed:
+            print(f"Restarting the upload of {self.location} from scratch.")
+            self.restart()
+        self.size = offset
+
+    def write(self, data):
+        self._upload.write(data)
+        self.size += len(data)
+
+    def close(self):
+        pass
+
+    def finish(self):
+        if self.expected_size and self.size != self.expected_size:
+            raise ValueError(f"Downloaded size {self.size} does not match expected size {self.expected_size}")
+        try:
+            self._upload.finish()
+        except BaseException:
+            # Do not leave the uploaded parts behind when the upload cannot be completed
+            self.abort()
+            raise
+        upload, self._upload = self._upload, None
+        try:
+            digests = _verify_checksums(upload.hashers, self.expected_checksums)
+        except ValueError:
+            self.storage.delete(self.path)
+            raise
+        return DownloadResult(self.size, digests['sha256'])
+
+    def keep_for_resume(self):
+        if self._upload is not None and self.expected_size and self.size < self.expected_size:
+            return True
+        self.abort()
+        return False
+
+    def abort(self):
+        """Abort the upload, so no half-finished upload (and its stored parts) is left behind."""
+        if self._upload is not None:
+            self._upload.abort()
+            self._upload = None
+
+def new_target(job, storage, preallocate=False):
+    """The PartFile or UploadTarget a download job writes to."""
+    if storage.local:
+        return PartFile(job['local_path'], job['expected_size'], job.get('checksums'), preallocate)
+    return UploadTarget(storage, job['local_path'], job['expected_size'], job.get('checksums'))
+
+def report_transfer(target, result, resumed_from, seconds, attempts):
+    """Log and count a finished transfer, speed over the bytes transferred by the last attempt."""
+    time_taken = max(seconds, 1e-6)
+    speed = (result.size - resumed_from) / time_taken  # bytes per second
+    message = f"{target.verb} {target.location}, Size: {result.size} bytes, Time: {time_taken:.2f} seconds, Speed: {speed / (1024 * 1024):.2f} MB/s"
+    logging.info(message)
+    print(message)
+    METRICS.incr('download_seconds', time_taken)
+    METRICS.observe('download_mb_per_second', speed / (1024 * 1024))
+    METRICS.event('download', path=target.location, bytes=result.size - resumed_from, resumed_from=resumed_from,
+                  seconds=round(time_taken, 3), attempts=attempts)
+
+def adopt_stored_file(job, storage, manifest=None):
+    """True if the job's file is already stored at the right size (e.g. from runs before the manifest existed), recording it as done."""
+    expected_size = job['expected_size']
+    if not expected_size or not storage.exists(job['local_path'], expected_size):
+        return False
+    location = storage.location(job['local_path'])
+    print(f"Skipping {location}, already downloaded.")
+    METRICS.incr('files_adopted')
+    if manifest:
+        manifest.mark_completed(job['meeting_uuid'], job['file_id'], location, expected_size)
+    return True
+
+def record_transfer(job, result, location, manifest=None):
+    """Count and record the result of a job's transfer. Returns the bytes downloaded, or None if it failed."""
+    if result is None:
+        METRICS.incr('files_failed', recording_type=job.get('recording_type'))
+        if manifest:
+            manifest.mark_failed(job['meeting_uuid'], job['file_id'], location, job['expected_size'])
+        return None
+    METRICS.incr('files_downloaded', recording_type=job.get('recording_type'))
+    METRICS.incr('bytes_downloaded', result.size, recording_type=job.get('recording_type'))
+    if manifest:
+        manifest.mark_completed(job['meeting_uuid'], job['file_id'], location, result.size, sha256=result.sha256)
+    print(f"Folder and files for {job['meeting_uuid']} created and downloaded successfully.")
+    return result.size
+
+class JobPool(ABC):
+    """Queueing and bookkeeping shared by the download pools of both engines.
+
+    Jobs are dicts with meeting_uuid, file_id, url, local_path, expected_size and
+    optionally checksums and priority. Queued jobs are started lowest priority
+    first (then in submission order), see DownloadRules.priority. Subclasses run
+    max_workers workers that take (priority, sequence, job, future) items off
+    _queue, stop at a None job and call _job_finished() for every job they ran,
+    and set concurrency to describe them in the closing report. close()
+    finishes every queued job, abort() drops them and stops the running
+    downloads.
+    """
+
+    def __init__(self, max_workers=1, manifest=None, max_queued=None):
+        self.max_workers = max(1, int(max_workers))
+        self.manifest = manifest
+        self._queue = queue.PriorityQueue()
+        self._sequence = 0
+        # Bounds the jobs submitted but not finished, submit() blocks once it is reached
+        self._slots = threading.Semaphore(max(self.max_workers, int(max_queued))) if max_queued else None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._start_time = time.time()
+        self.downloaded_files = 0
+        self.failed_files = 0
+        self.total_bytes = 0
+
+    def _notify(self):
+        """Called after each item is queued, for workers that do not block on _queue."""
+
+    def submit(self, jobs):
+        """Queue jobs and return their futures, blocking while max_queued jobs are unfinished."""
+        futures = []
+        for job in jobs:
+            if self._slots:
+                self._slots.acquire()
+            future = Future()
+            with self._lock:
+                self._sequence += 1
+                sequence = self._sequence
+            self._queue.put((job.get('priority', ()), sequence, job, future))
+            self._notify()
+            futures.append(future)
+        return futures
+
+    @staticmethod
+    def wait(futures):
+        """Wait for futures from submit() and return (downloaded_files, failed_files, total_bytes) for them."""
+        downloaded_files = 0
+        failed_files = 0
+        total_bytes = 0
+        for future in as_completed(futures):
+            downloaded = future.result()
+            if downloaded is None:
+                failed_files += 1
+            else:
+                downloaded_files += 1
+                total_bytes += downloaded
+        return downloaded_files, failed_files, total_bytes
+
+    def abort(self):
+        """Cancel the queued jobs and stop the running downloads, for when the run fails or is interrupted.
+
+        Cancelled jobs' futures are cancelled and their slots released, so a
+        blocked submit() returns. Running downloads stop early and keep their
+        partial data. Call close() afterwards to wait for the workers.
+        """
+        self._cancel.set()
+        while True:
+            try:
+                _, _, job, future = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is None:
+                continue
+            future.cancel()
+            if self._slots:
+                self._slots.release()
+
+    @abstractmethod
+    def _join_workers(self):
+        """Wait until every worker has stopped."""
+
+    def _stop_workers(self):
+        for _ in range(self.max_workers):
+            # Sorts after every job, so the workers drain the queue before they stop
+            self._queue.put(((float('inf'),), 0, None, None))
+            self._notify()
+
+    def close(self):
+        """Wait for every queued job and report the aggregate throughput. Interrupting the wait aborts the pool."""
+        self._stop_workers()
+        try:
+            self._join_workers()
+        except BaseException:
+            # abort() drops the stop items along with the queued jobs
+            self.abort()
+            self._stop_workers()
+            self._join_workers()
+            raise
+        finally:
+            self._report()
+
+    def _job_finished(self, downloaded):
+        """Free the job's slot and count its result, downloaded being its bytes or None if it failed."""
+        if self._slots:
+            self._slots.release()
+        with self._lock:
+            if downloaded is None:
+                self.failed_files += 1
+            else:
+                self.downloaded_files += 1
+                self.total_bytes += downloaded
+
+    def _report(self):
+        time_taken = max(time.time() - self._start_time, 1e-6)
+        speed = self.total_bytes / time_taken
+        message = (f"Downloaded {self.downloaded_files} files ({self.failed_files} failed), Total: {self.total_bytes} bytes, "
+                   f"Time: {time_taken:.2f} seconds, Throughput: {speed / (1024 * 1024):.2f} MB/s {self.concurrency}")
+        logging.info(message)
+        print(message)
@@ -1,14 +1,31 @@
 import os
 import requests
 import pickle
-from dateutil.relativedelta import relativedelta
 import json
 import time
 from tqdm import tqdm  # Import tqdm for progress bar
 import datetime
 import base64
+import hashlib
 import logging
-from dotenv import load_dotenv
+import queue
+import threading
+from manifest import open_manifest
+from request_scheduler import SCHEDULER
+from http_session import configure_session, report_connection_stats
+from token_manager import TokenManager
+from listing_cache import open_listing_cache
+from bandwidth import BANDWIDTH
+from metrics import METRICS, configure_metrics, profiled
+from download_filters import load_download_rules
+from storage import LocalStorage, StorageError, open_storage
+from transfers import (DownloadResult, DownloadCancelled, JobPool, PartFile, new_target, adopt_stored_file, record_transfer,
+                       report_transfer)
+from listing import WindowListing, month_windows, iter_window_listings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from dotenv import load_dotenv, find_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,14 +36,33 @@ USER_ID = os.getenv('USER_ID')
 REFRESH_TOKEN = os.getenv('REFRESH_TOKEN')
 CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
+# Set for a Server-to-Server OAuth app, which needs no ACCESS_TOKEN/REFRESH_TOKEN
+ACCOUNT_ID = os.getenv('ACCOUNT_ID')
 
-if not all([ACCESS_TOKEN, USER_ID, REFRESH_TOKEN, CLIENT_ID, CLIENT_SECRET]):
-    raise ValueError("Missing one or more environment variables.")
+def require_credentials(user_id_required=True):
+    if ACCOUNT_ID:
+        required = [CLIENT_ID, CLIENT_SECRET]
+    else:
+        required = [ACCESS_TOKEN, REFRESH_TOKEN, CLIENT_ID, CLIENT_SECRET]
+    if user_id_required:
+        required.append(USER_ID)
+    if not all(required):
+        raise ValueError("Missing one or more environment variables.")
+
+# Endpoints can be pointed at a local stand-in for testing
+ZOOM_API_BASE_URL = os.getenv('ZOOM_API_BASE_URL', 'https://api.zoom.us/v2').rstrip('/')
+ZOOM_OAUTH_URL = os.getenv('ZOOM_OAUTH_URL', 'https://zoom.us/oauth/token')
+
+# Shared token state, rotated refresh tokens are written back to .env
+TOKENS = TokenManager(CLIENT_ID, CLIENT_SECRET, ACCESS_TOKEN, REFRESH_TOKEN,
+                      token_url=ZOOM_OAUTH_URL, env_file=find_dotenv() or None, account_id=ACCOUNT_ID)
 
 logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+CONFIG_FILE = "C:\\Users\\CTL-118\\Documents\\zoom-recordings-backup-main\\config.json"
+
 def load_config():
-    config_file = "C:\\Users\\CTL-118\\Documents\\zoom-recordings-backup-main\\config.json"
+    config_file = CONFIG_FILE
     if not os.path.exists(config_file):
         raise FileNotFoundError(f"Configuration file not found: {config_file}")
     
@@ -40,60 +76,369 @@ def load_config():
             raise ValueError(f"Error decoding JSON from file: {config_file}") from e
     return config
 
-def check_zoom_rate_limits():
-    url = 'https://api.zoom.us/v2/users/vivek@codingal.com/recordings'
-    headers = {'Authorization': 'Bearer YOUR_ACCESS_TOKEN'}
-    response = requests.get(url, headers=headers)
+def check_zoom_rate_limits(user_id=None):
+    url = f"{ZOOM_API_BASE_URL}/users/{user_id or USER_ID}/recordings"
+    headers = {'Authorization': f"Bearer {TOKENS.get_token()}"}
+    response = SCHEDULER.get(url, headers=headers, params={'page_size': 1})
     
     # Print rate limit headers
     print(response.headers.get('X-RateLimit-Limit'))
     print(response.headers.get('X-RateLimit-Remaining'))
     print(response.headers.get('X-RateLimit-Reset'))
 
-def download_recording(url, file_name, expected_size=None):
+# Hash algorithms Zoom might report for a recording file, by metadata key
+ZOOM_CHECKSUM_KEYS = ('md5', 'sha1', 'sha256')
+
+def recording_file_id(file):
+    """Key of a recording file in the manifest (some in-progress files come without an id)."""
+    return file.get('id') or file['download_url']
+
+def zoom_checksums(file):
+    """Return {algorithm: hexdigest} for any checksum Zoom includes in the file's metadata."""
+    return {key: file[key].lower() for key in ZOOM_CHECKSUM_KEYS if isinstance(file.get(key), str) and file[key]}
+
+# Downloads are read into DOWNLOAD_BUFFER_COUNT reusable buffers of DOWNLOAD_BUFFER_SIZE bytes
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+DOWNLOAD_BUFFER_COUNT = 4
+# Reserve the full file_size on disk before writing
+PREALLOCATE_FILES = False
+
+# Reads per throttled step while a bandwidth limit applies
+THROTTLE_STEP = 64 * 1024
+# Where finished recordings go, see storage.py
+STORAGE = LocalStorage()
+
+def configure_downloads(config, processes=1):
+    """Apply the download settings from config. processes is the number of processes sharing the bandwidth limit."""
+    global DOWNLOAD_BUFFER_SIZE, DOWNLOAD_BUFFER_COUNT, PREALLOCATE_FILES, STORAGE
+    DOWNLOAD_BUFFER_SIZE = int(config.get('download_buffer_size', DOWNLOAD_BUFFER_SIZE))
+    DOWNLOAD_BUFFER_COUNT = max(2, int(config.get('download_buffer_count', DOWNLOAD_BUFFER_COUNT)))
+    PREALLOCATE_FILES = config.get('preallocate_files', PREALLOCATE_FILES)
+    STORAGE = open_storage(config)
+    # Bandwidth limits follow config.json while the run goes on
+    BANDWIDTH.configure(config, config_path=CONFIG_FILE, reload=load_config, processes=processes)
+
+def _read_into(raw, view):
+    """Fill view from the raw response stream, returning fewer bytes only at the end of the body."""
+    filled = 0
+    while filled < len(view):
+        # Small steps under a bandwidth limit, so the pacing is smooth rather than bursty
+        end = min(len(view), filled + THROTTLE_STEP) if BANDWIDTH.limited else len(view)
+        try:
+            count = raw.readinto(view[filled:end])
+        except Urllib3HTTPError as e:
+            # Surface network errors like iter_content does, so the retry loop handles them
+            raise requests.ConnectionError(e) from e
+        if not count:
+            break
+        filled += count
+        if BANDWIDTH.limited:
+            with METRICS.timer('throttle_wait_seconds'):
+                BANDWIDTH.consume(count)
+    return filled
+
+def _stream_to_file(response, target, pbar, cancel=None):
+    """Copy the response body into target (see transfers.PartFile), with a writer thread so network reads and writes overlap.
+
+    Hashing happens on the writer thread as well, in target.write(). Raises
+    DownloadCancelled once the cancel event is set. Returns the number of bytes
+    written.
+    """
+    free_buffers = queue.Queue()
+    for _ in range(DOWNLOAD_BUFFER_COUNT):
+        free_buffers.put(bytearray(DOWNLOAD_BUFFER_SIZE))
+    filled_buffers = queue.Queue()
+    writer_errors = []
+
+    def writer():
+        while True:
+            item = filled_buffers.get()
+            if item is None:
+                return
+            buffer, length = item
+            if not writer_errors:
+                try:
+                    target.write(memoryview(buffer)[:length])
+                except Exception as e:
+                    writer_errors.append(e)
+            free_buffers.put(buffer)
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    total_size = 0
+    # Time the reader spent waiting for the writer to hand back a buffer
+    disk_wait = 0.0
+    response.raw.decode_content = True
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            buffer = free_buffers.get()
+            disk_wait += time.perf_counter() - wait_start
+            if writer_errors:
+                break
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled()
+            length = _read_into(response.raw, memoryview(buffer))
+            if not length:
+                break
+            filled_buffers.put((buffer, length))
+            total_size += length
+            pbar.update(length)
+    finally:
+        filled_buffers.put(None)
+        writer_thread.join()
+        METRICS.incr('disk_wait_seconds', disk_wait)
+    if writer_errors:
+        raise writer_errors[0]
+    return total_size
+
+def _get_download(url, token_manager=None, headers=None):
+    """GET a download URL, signed with the current token and retried once with a fresh one on 401."""
+    token = token_manager.get_token() if token_manager else None
+    response = SCHEDULER.get(token_manager.sign_url(url, token) if token_manager else url, stream=True, headers=headers or {})
+    if response.status_code == 401 and token_manager:
+        response.close()
+        METRICS.incr('http_401', endpoint='download')
+        print("Download link rejected the access token, refreshing...")
+        token = token_manager.refresh(stale_token=token)
+        response = SCHEDULER.get(token_manager.sign_url(url, token), stream=True, headers=headers or {})
+    return response
+
+def transfer_recording(url, target, token_manager=None, cancel=None):
+    """Download url into target, a transfers.PartFile or UploadTarget, hashing the stream on the fly.
+
+    Returns a DownloadResult(size, sha256) or None if every attempt failed. Each
+    attempt resumes where the target says the previous one stopped. With
+    token_manager, url is signed with the current access token on every request.
+    Setting the cancel event raises DownloadCancelled, keeping the partial data.
+    """
     max_retries = 3
     retry_delay = 5  # seconds
-    for attempt in range(max_retries):
-        try:
+    try:
+        for attempt in range(max_retries):
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled()
             start_time = time.time()  # Start time
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            total_size=0
-
-            with open(file_name, 'wb') as f, tqdm(total=expected_size, unit='B', unit_scale=True, desc=file_name) as pbar:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    total_size += len(chunk)
-                    pbar.update(len(chunk))
-
-            end_time = time.time()  # End time
-
-             # Check if the downloaded file matches the expected size
-            if expected_size and total_size != expected_size:
-                raise ValueError(f"Downloaded size {total_size} does not match expected size {expected_size}")
-       
-            # Calculate speed
-            file_size = os.path.getsize(file_name)
-            time_taken = end_time - start_time
-            speed = file_size / time_taken  # bytes per second
-
-            logging.info(f"Downloaded {file_name}, Size: {file_size} bytes, Time: {time_taken:.2f} seconds, Speed: {speed / (1024 * 1024):.2f} MB/s")
-            print(f"Downloaded {file_name}, Size: {file_size} bytes, Time: {time_taken:.2f} seconds, Speed: {speed / (1024 * 1024):.2f} MB/s")
-            return
-
-        except requests.RequestException as e:
-            print(f"Error downloading {url}: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print(f"Failed to download {url} after {max_retries} attempts")
-
-        except ValueError as ve:
-            print(f"Download size mismatch: {ve}")
-            os.remove(file_name)
-
-def create_folders_and_download(recordings_data, base_dir, ACCESS_TOKEN=None):
+            try:
+                resume_from = target.resume_offset()
+                # A previous attempt may have fetched every byte already, with only the rename missing
+                if not target.has_all(resume_from):
+                    headers = {'Range': f"bytes={resume_from}-"} if resume_from else {}
+                    response = _get_download(url, token_manager, headers)
+                    if resume_from and response.status_code == 416:
+                        response.close()
+                        print(f"Server rejected resuming {target.location} at byte {resume_from}, restarting from scratch.")
+                        target.restart()
+                        resume_from = 0
+                        response = _get_download(url, token_manager)
+                    response.raise_for_status()
+
+                    if resume_from and response.status_code != 206:
+                        print(f"Server ignored the Range request for {target.location}, restarting from scratch.")
+                        resume_from = 0
+                    elif resume_from:
+                        print(f"Resuming {target.location} from byte {resume_from}")
+
+                target.start(resume_from)
+                if not target.has_all(resume_from):
+                    with tqdm(total=target.expected_size, initial=resume_from, unit='B', unit_scale=True, desc=target.location) as pbar:
+                        _stream_to_file(response, target, pbar, cancel)
+
+                # Checks the size and any checksum Zoom provided before the file is moved into place
+                result = target.finish()
+                report_transfer(target, result, resume_from, time.time() - start_time, attempt + 1)
+                return result
+
+            except (requests.RequestException, StorageError) as e:
+                # Keep the partial data so the next attempt resumes where this one stopped
+                print(f"Error downloading {url}: {e}")
+                METRICS.incr('download_seconds', time.time() - start_time)
+                METRICS.incr('download_errors', kind='network')
+                if attempt < max_retries - 1:
+                    METRICS.incr('download_retries')
+                    print(f"Retrying in {retry_delay} seconds...")
+                    if cancel is not None:
+                        cancel.wait(retry_delay)
+                    else:
+                        time.sleep(retry_delay)
+                else:
+                    print(f"Failed to download {url} after {max_retries} attempts")
+
+            except ValueError as ve:
+                print(f"Download verification failed: {ve}")
+                METRICS.incr('download_seconds', time.time() - start_time)
+                METRICS.incr('download_errors', kind='verification')
+                if attempt < max_retries - 1:
+                    METRICS.incr('download_retries')
+                # A short read resumes from what we have, anything else starts over
+                target.keep_for_resume()
+
+        return None
+    finally:
+        # Keeps a .part file for the next run, but leaves no half-finished upload behind
+        target.abort()
+
+def download_recording(url, file_name, expected_size=None, expected_checksums=None, token_manager=None, cancel=None):
+    """Download url to file_name through a .part file, see transfer_recording.
+
+    expected_checksums is an optional {algorithm: hexdigest} the download must match.
+    """
+    return transfer_recording(url, PartFile(file_name, expected_size, expected_checksums, PREALLOCATE_FILES), token_manager, cancel)
+
+# Per-host semaphores shared by all download workers
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+def _host_semaphore(url, per_host_limit):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(per_host_limit)
+        return _host_semaphores[host]
+
+def _download_job(job, per_host_limit=None, manifest=None, token_manager=None, cancel=None):
+    try:
+        if adopt_stored_file(job, STORAGE, manifest):
+            return 0
+
+        # Do not open a connection while the bandwidth schedule pauses downloads
+        if not BANDWIDTH.wait_until_allowed(cancel):
+            raise DownloadCancelled()
+
+        target = new_target(job, STORAGE, PREALLOCATE_FILES)
+        if per_host_limit:
+            with _host_semaphore(job['url'], per_host_limit):
+                result = transfer_recording(job['url'], target, token_manager, cancel)
+        else:
+            result = transfer_recording(job['url'], target, token_manager, cancel)
+        return record_transfer(job, result, target.location, manifest)
+    except DownloadCancelled:
+        print(f"Download of {job['local_path']} cancelled, it resumes on the next run.")
+        return None
+    except Exception as e:
+        print(f"Error processing meeting {job['meeting_uuid']}: {str(e)}")
+        logging.error(f"An error occurred: {e}", exc_info=True)
+        return None
+
+class DownloadPool(JobPool):
+    """Bounded pool of download threads shared by the downloads of every month window in a run.
+
+    See transfers.JobPool for the jobs and their order. With token_manager, job
+    URLs are signed when each request is made, so long queues never carry an
+    expired token.
+    """
+
+    def __init__(self, max_workers=1, per_host_limit=None, manifest=None, token_manager=None, max_queued=None):
+        super().__init__(max_workers, manifest, max_queued)
+        self.per_host_limit = per_host_limit
+        self.token_manager = token_manager
+        self.concurrency = f"across {self.max_workers} workers"
+        self._workers = [threading.Thread(target=self._worker, name=f"download-{i}", daemon=True) for i in range(self.max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _worker(self):
+        while True:
+            _, _, job, future = self._queue.get()
+            if job is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run_job(job))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _run_job(self, job):
+        downloaded = None
+        try:
+            downloaded = _download_job(job, self.per_host_limit, self.manifest, self.token_manager, self._cancel)
+        finally:
+            self._job_finished(downloaded)
+        return downloaded
+
+    def _join_workers(self):
+        for worker in self._workers:
+            worker.join()
+
+def run_download_jobs(jobs, max_workers=1, per_host_limit=None, manifest=None, token_manager=None):
+    """Download jobs on a bounded worker pool.
+
+    Returns a (downloaded_files, failed_files, total_bytes) tuple and reports the
+    aggregate throughput across all workers.
+    """
+    if not jobs:
+        return 0, 0, 0
+
+    pool = DownloadPool(max_workers=max_workers, per_host_limit=per_host_limit, manifest=manifest, token_manager=token_manager)
+    try:
+        return pool.wait(pool.submit(jobs))
+    except BaseException:
+        pool.abort()
+        raise
+    finally:
+        pool.close()
+
+def recording_file_name(file):
+    """Return (name, duration_in_minutes) of a recording file: <recording_type>_duration_<minutes>_minutes.<extension>."""
+    # Convert the strings to datetime objects
+    start_time = datetime.datetime.strptime(file['recording_start'], "%Y-%m-%dT%H:%M:%SZ")
+    end_time = datetime.datetime.strptime(file['recording_end'], "%Y-%m-%dT%H:%M:%SZ")
+
+    # Calculate the duration
+    recording_length = end_time - start_time
+    duration_in_minutes = int(recording_length.total_seconds() // 60) #Convert to minutes
+    return f"{file['recording_type'].replace(' ', '_')}_duration_{duration_in_minutes}_minutes.{file['file_extension'].lower()}", duration_in_minutes
+
+def recording_file_names(files):
+    """Return {file_id: (name, duration_in_minutes)} for the files of one meeting.
+
+    Restarted segments of the same type and length would share a name, so the
+    ones after the first (in recording order) get _2, _3, ... and no two
+    downloads ever write the same path. Files whose metadata is incomplete are
+    left out.
+    """
+    named = []
+    for file in files:
+        try:
+            named.append((file.get('recording_start') or '', recording_file_id(file), recording_file_name(file)))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    names = {}
+    seen = {}
+    for _, file_id, (name, duration_in_minutes) in sorted(named):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem}_{seen[name]}{extension}"
+        names[file_id] = (name, duration_in_minutes)
+    return names
+
+def _backed_up(manifest, meeting_uuid, file_id, expected_size, local_path):
+    """True if the manifest has the file completed at this path, and for local storage it is still on disk at that size."""
+    if not manifest.is_completed(meeting_uuid, file_id, expected_size, path=STORAGE.location(local_path)):
+        return False
+    if not STORAGE.local:
+        return True
+    # One stat, so files deleted or truncated since their backup are downloaded again
+    try:
+        size_on_disk = os.path.getsize(local_path)
+    except OSError:
+        return False
+    return not expected_size or size_on_disk == expected_size
+
+def plan_downloads(recordings_data, base_dir, manifest=None, rules=None):
+    """Create the meeting folders and build the download jobs for recordings_data.
+
+    Files rejected by rules (a DownloadRules) are left out, the others get their
+    queue priority from it. Returns a (jobs, failed_files) tuple, where
+    failed_files counts files whose metadata could not be turned into a job.
+    """
+    jobs = []
+    skipped_files = 0
+    filtered_files = 0
+    failed_files = 0
 
     for recording in recordings_data:
         # Format the folder name as <topic>_<start_time> in YYYY-MM-DD HH:MM format
@@ -105,182 +450,505 @@ def create_folders_and_download(recordings_data, base_dir, ACCESS_TOKEN=None):
         # Replace any other potentially invalid characters if necessary (e.g., for Windows)
         folder_name = folder_name.replace(':', '-').replace('/', '-').replace('\\', '-').replace('<','-').replace('>','-').replace('|','-').replace('?','Q').replace('*','asterisk').strip()
 
-        # Create folder in local Google Drive folder
+        # Create folder in local Google Drive folder (remote backends create theirs on upload)
         meeting_folder = os.path.join(base_dir, folder_name)
-        os.makedirs(meeting_folder, exist_ok=True)
-        
+        if STORAGE.local:
+            os.makedirs(meeting_folder, exist_ok=True)
+
+        file_names = recording_file_names(recording.get('recording_files', []))
         for file in recording.get('recording_files', []):
             try:
-                file_url = file['download_url'] + "?access_token=" + ACCESS_TOKEN
-                file_extension = file['file_extension'].lower()
-                
-                # Convert the strings to datetime objects
-                start_time = datetime.datetime.strptime(file['recording_start'], "%Y-%m-%dT%H:%M:%SZ")
-                end_time = datetime.datetime.strptime(file['recording_end'], "%Y-%m-%dT%H:%M:%SZ")
-
-                # Calculate the duration
-                recording_length = end_time - start_time
-                duration_in_minutes = int(recording_length.total_seconds() // 60) #Convert to minutes
+                file_id = recording_file_id(file)
+                file_name, duration_in_minutes = file_names.get(file_id) or recording_file_name(file)
 
                 # Construct the local path using os.path.join, with safe file naming and proper formatting
-                local_path = os.path.join(meeting_folder, f"{file['recording_type'].replace(' ', '_')}_duration_{duration_in_minutes}_minutes.{file_extension}")
+                local_path = os.path.join(meeting_folder, file_name)
+
+                # Files the manifest already has as complete are skipped without touching the network
+                if manifest and _backed_up(manifest, recording['uuid'], file_id, file.get('file_size'), local_path):
+                    skipped_files += 1
+                    continue
+
+                # The access token is added when the request is made, see download_recording
+                file_url = file['download_url']
+
+                # Leave out files the include/exclude rules do not want
+                if rules and not rules.accepts(file, duration_in_minutes):
+                    filtered_files += 1
+                    METRICS.incr('files_filtered', recording_type=file.get('recording_type'))
+                    continue
 
                 # Fetch the expected size from the metadata
                 expected_size = file.get('file_size', None)
                 
-                # # Download and upload each recording file
-                download_recording(file_url, local_path, expected_size=expected_size)
-
-                print(f"Folder and files for {recording['uuid']} created and downloaded successfully.")
+                # Queue each recording file for the download workers
+                jobs.append({
+                    'meeting_uuid': recording['uuid'],
+                    'file_id': file_id,
+                    'url': file_url,
+                    'local_path': local_path,
+                    'expected_size': expected_size,
+                    'checksums': zoom_checksums(file),
+                    'recording_type': file.get('recording_type'),
+                    'priority': rules.priority(file) if rules else (),
+                })
             except Exception as e:
+                failed_files += 1
                 print(f"Error processing meeting {recording['uuid']}: {str(e)}")
                 logging.error(f"An error occurred: {e}", exc_info=True)
 
+    if skipped_files:
+        print(f"Skipped {skipped_files} files already recorded as complete in the manifest.")
+    if filtered_files:
+        print(f"Skipped {filtered_files} files excluded by the download filters.")
+
+    return jobs, failed_files
+
+def create_folders_and_download(recordings_data, base_dir, max_workers=1, per_host_limit=None, manifest=None, token_manager=None, rules=None):
+    jobs, failed_files = plan_downloads(recordings_data, base_dir, manifest=manifest, rules=rules)
+    downloaded_files, download_failures, total_bytes = run_download_jobs(jobs, max_workers=max_workers, per_host_limit=per_host_limit, manifest=manifest, token_manager=token_manager)
+    return downloaded_files, failed_files + download_failures, total_bytes
+
 
 def encode_credentials(client_id, client_secret):
     credentials = f"{client_id}:{client_secret}"
     return base64.b64encode(credentials.encode()).decode('utf-8')
 
 
-def refresh_access_token():
-    global ACCESS_TOKEN, REFRESH_TOKEN
-    token_url = "https://zoom.us/oauth/token"
-    headers = {
-        "Authorization": f"Basic {encode_credentials(CLIENT_ID, CLIENT_SECRET)}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    token_data = {
-        "grant_type": "refresh_token",
-        "refresh_token": REFRESH_TOKEN,
-    }
-    response = requests.post(token_url, headers=headers, data=token_data)
-    if response.status_code == 200:
-        token_info = response.json()
-        print("Access Token refreshed successfully")
-        ACCESS_TOKEN = token_info['access_token']
-        REFRESH_TOKEN = token_info['refresh_token']
-    else:
-        print(f"Error refreshing access token: {response.status_code} {response.text}")
-
-def fetch_recordings(start_date, end_date):
-    url = f"https://api.zoom.us/v2/users/{USER_ID}/recordings"
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}"
-    }
-
-    # Format the dates in the required format (YYYY-MM-DD)
-    params = {
-        "from": f"{start_date}T00:00:00Z",
-        "to": f"{end_date}T23:59:59Z",
-        "page_size": 30  # Adjust page_size if needed
-    }
+def refresh_access_token(stale_token=None):
+    """Refresh the shared access token, unless another worker already replaced stale_token."""
+    return TOKENS.refresh(stale_token=stale_token)
+
+# Shared on-disk cache of listing pages (None when disabled) and whether to skip reading it
+LISTING_CACHE = None
+BYPASS_LISTING_CACHE = False
+
+def configure_requests(config):
+    """Apply the request scheduling settings from config and return the number of concurrent listing workers."""
+    # 'listing_requests_per_second' is the older name of the API budget
+    api_requests_per_second = config.get('api_requests_per_second', config.get('listing_requests_per_second', None))
+    SCHEDULER.set_rate(urlparse(ZOOM_API_BASE_URL).netloc, api_requests_per_second, config.get('api_burst', None))
+    SCHEDULER.configure(max_retries=config.get('max_rate_limit_retries', None))
+
+    global LISTING_CACHE, BYPASS_LISTING_CACHE
+    LISTING_CACHE = open_listing_cache(config)
+    BYPASS_LISTING_CACHE = config.get('bypass_listing_cache', False)
+
+    # Tokens are refreshed this many seconds before they expire
+    TOKENS.configure(refresh_margin=config.get('access_token_refresh_margin', None),
+                     default_lifetime=config.get('access_token_refresh_frequency', None))
+
+    # Keep at least one pooled connection per thread that can talk to the same host
+    max_concurrent_listings = max(1, int(config.get('max_concurrent_listings', 1)))
+    default_pool_size = max(10, max_concurrent_listings + int(config.get('max_concurrent_downloads', 1)))
+    configure_session(pool_size=config.get('http_pool_size', default_pool_size),
+                      connect_timeout=config.get('http_connect_timeout', 10),
+                      read_timeout=config.get('http_read_timeout', 60))
+    return max_concurrent_listings
+
+def iter_recording_pages(start_date, end_date, user_id=None):
+    """Yield the meetings with cloud recordings between start_date and end_date, one API page at a time.
+
+    user_id defaults to USER_ID from .env.
+
+    The generator's return value (StopIteration.value) is True if every page was
+    listed, and False if listing stopped early because of an API or token error.
+    Complete listings are cached in LISTING_CACHE and served from there while fresh.
+    """
+    listing = WindowListing(ZOOM_API_BASE_URL, user_id or USER_ID, start_date, end_date, LISTING_CACHE, BYPASS_LISTING_CACHE)
+    cached_pages = listing.cached_pages()
+    if cached_pages is not None:
+        yield from cached_pages
+        return True
 
+    try:
+        while not listing.done:
+            page_start = time.perf_counter()
+            old_token = TOKENS.get_token()
+            headers = {
+                "Authorization": f"Bearer {old_token}"
+            }
+            response = SCHEDULER.get(listing.url, headers=headers, params=listing.params)
+            #print(f"Response Status Code: {response.status_code}")
+            #print(f"Response Content: {response.text}")
+
+            if response.status_code == 401:  # Invalid access token
+                METRICS.incr('http_401', endpoint='recordings')
+                print("Access token invalid, refreshing...")
+
+                new_token = refresh_access_token(stale_token=old_token)
+
+                if new_token != old_token:
+                    headers["Authorization"] = f"Bearer {new_token}"
+                    response = SCHEDULER.get(listing.url, headers=headers, params=listing.params)
+                    print("Access Token refreshed successfully")
+                else:
+                    print("Failed to refresh access token.")
+                    return False  # Stop with whatever pages were already yielded
+
+            listing.record_page(response.status_code, time.perf_counter() - page_start)
+
+            if response.status_code != 200:
+                print(f"Error fetching recordings: {response.status_code} {response.text}")
+                return False
+
+            # Hand the page to the caller before requesting the next one
+            meetings = listing.add_page(response.json())
+            if meetings:
+                yield meetings
+
+        listing.commit()
+        return True
+    finally:
+        listing.discard()
+
+def iter_recordings(start_date, end_date, user_id=None):
+    """Generator form of fetch_recordings, yielding meetings as their page arrives."""
+    for meetings in iter_recording_pages(start_date, end_date, user_id=user_id):
+        yield from meetings
+
+def list_recordings(start_date, end_date, user_id=None):
+    """Fetch every meeting with cloud recordings between start_date and end_date.
+
+    Returns a (recordings, complete) tuple, where complete is False if listing
+    stopped early because of an API or token error.
+    """
     recordings = []
+    pages = iter_recording_pages(start_date, end_date, user_id=user_id)
     while True:
-        #print(f"Request URL: {url}")
-        #print(f"Parameters: {params}")
-
-        response = requests.get(url, headers=headers, params=params)
-        #print(f"Response Status Code: {response.status_code}")
-        #print(f"Response Content: {response.text}")
-
-        if response.status_code == 401:  # Invalid access token
-            print("Access token invalid, refreshing...")
-
-            old_token = ACCESS_TOKEN
-
-            refresh_access_token()
-
-            if ACCESS_TOKEN != old_token:
-                headers["Authorization"] = f"Bearer {ACCESS_TOKEN}"
-                response = requests.get(url, headers=headers, params=params)
-                print("Access Token refreshed successfully")
-            else:
-                print("Failed to refresh access token.")
-                return recordings  # Exit with whatever data we have so far
-        
-        if response.status_code == 200:
-            data = response.json()
-            #print(f"Data received for page:")
-            print(f"From: {data['from']} To: {data['to']}")
-            print(f"Total Records: {data['total_records']}")
-            if data.get('meetings'):
-                #print(f"Sample Meeting: {data['meetings'][0]['topic']} | {data['meetings'][0]['start_time']}")
-                recordings.extend(data['meetings'])  # Collect meetings data
-            else:
-                print("No meetings found in this time period.")
-                break
-
-            # Check if there are more pages
-            next_page_token = data.get('next_page_token')
-            if next_page_token:
-                print("Next page token found, fetching next page...")
-                params['next_page_token'] = next_page_token
-            else:
-                print("No more pages to fetch.")
-                break
+        try:
+            recordings.extend(next(pages))
+        except StopIteration as stop:
+            return recordings, stop.value
 
-        else:
-            print(f"Error fetching recordings: {response.status_code} {response.text}")
-            break
-        
-    print("All recordings fetched successfully:")
-    print(f"Total meetings fetched: {len(recordings)}")
+def fetch_recordings(start_date, end_date, user_id=None):
+    recordings, _ = list_recordings(start_date, end_date, user_id=user_id)
     return recordings
 
-def main():
-    try:
-        config = load_config()
-        base_dir = os.path.join(config['base_dir'], USER_ID)
-        start_date = config['start_date']
-        config_end_date = config['end_date']
-        today = datetime.date.today()
-
-        # Initialize access token timer and refresh frequency
-        access_token_refresh_frequency = config.get('access_token_refresh_frequency', 3500)  # default to 1 hour if not set
-        access_token_elapsed_time = time.time()
-
-        # Initial access token refresh
-        refresh_access_token()
-
-        check_zoom_rate_limits()
+def stream_window(start_date, end_date, page_queue, user_id=None, stop=None):
+    """Put the pages of a window on page_queue as they are listed, followed by None.
 
+    Meant to run on a listing worker. page_queue must be unbounded: Zoom's page
+    tokens expire after 15 minutes, so the listing never waits for the downloads
+    with a token pending. Setting the stop event ends the listing after the
+    current page. Returns True if the listing was complete.
+    """
+    complete = False
+    try:
+        pages = iter_recording_pages(start_date, end_date, user_id=user_id)
         while True:
-            # Refresh access token if time exceeds the refresh frequency
-            if time.time() - access_token_elapsed_time >= access_token_refresh_frequency:
-                refresh_access_token()
-                access_token_elapsed_time = time.time()
-
-            # Calculate end_date as the earlier of 'start_date + 1 month' and 'config_end_date'
-            calculated_end_date = (datetime.datetime.strptime(start_date, "%Y-%m-%d") + relativedelta(months=1) - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-            end_date = min(calculated_end_date, config_end_date)
-
+            if stop is not None and stop.is_set():
+                pages.close()
+                return False
+            try:
+                page_queue.put(next(pages))
+            except StopIteration as stop_iteration:
+                complete = stop_iteration.value
+                return complete
+    finally:
+        page_queue.put(None)
+
+class ThreadEngine:
+    """The default "engine": "threads": listings on a thread pool and downloads on a DownloadPool.
+
+    backup_user and sync_check drive either engine through submit_listing(),
+    download_pool() and close(), see async_engine.AsyncEngine for the other one.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._listing_executor = ThreadPoolExecutor(max_workers=max(1, int(config.get('max_concurrent_listings', 1))))
+
+    def submit_listing(self, start_date, end_date, page_queue, user_id=None, stop=None):
+        """List a window on a listing worker, see stream_window. Returns a Future of its completeness."""
+        return self._listing_executor.submit(stream_window, start_date, end_date, page_queue, user_id, stop)
+
+    def download_pool(self, manifest=None):
+        # Download concurrency (1 keeps the old one-file-at-a-time behaviour)
+        return DownloadPool(max_workers=self.config.get('max_concurrent_downloads', 1),
+                            per_host_limit=self.config.get('max_downloads_per_host', None), manifest=manifest,
+                            token_manager=TOKENS, max_queued=self.config.get('max_queued_downloads', 1000))
+
+    def close(self):
+        self._listing_executor.shutdown(wait=True)
+
+def open_engine(config):
+    """Return the listing and download engine selected by config['engine'].
+
+    Expects configure_requests() and configure_downloads() to have run in this
+    process; the async engine gets their settings passed in.
+    """
+    if config.get('engine', 'threads') == 'async':
+        import async_engine
+        return async_engine.AsyncEngine(config, TOKENS, ZOOM_API_BASE_URL, STORAGE, listing_cache=LISTING_CACHE,
+                                        bypass_listing_cache=BYPASS_LISTING_CACHE, buffer_size=DOWNLOAD_BUFFER_SIZE,
+                                        preallocate=PREALLOCATE_FILES)
+    return ThreadEngine(config)
+
+def _advance_high_water_mark(manifest, key, pending_windows, today, wait=False):
+    """Move the incremental mark past the finished windows at the head of pending_windows.
+
+    pending_windows holds (window_end, listing_complete, failed_files, futures) in
+    window order. Returns False once a window turned out incomplete, after which
+    the mark must not move again during this run.
+    """
+    while pending_windows:
+        window_end, listing_complete, failed_files, futures = pending_windows[0]
+        if not wait and not all(future.done() for future in futures):
+            return True
+        _, download_failures, _ = DownloadPool.wait(futures)
+        pending_windows.pop(0)
+        if not listing_complete or failed_files or download_failures:
+            pending_windows.clear()
+            return False
+        high_water_mark = min(window_end, today)
+        manifest.set_state(key, high_water_mark)
+        print(f"Incremental sync: fully synced up to {high_water_mark}")
+    return True
+
+def backup_user(config, user_id, manifest):
+    """Back up the recordings of user_id into base_dir/<user_id>.
+
+    Expects configure_requests() and configure_downloads() to have run in this
+    process. Returns a (downloaded_files, failed_files, total_bytes) tuple, where
+    failed_files also counts every month window whose listing was incomplete.
+    """
+    base_dir = os.path.join(config['base_dir'], user_id)
+    start_date = config['start_date']
+    today = datetime.date.today()
+    config_end_date = config.get('end_date') or 'today'
+    if config_end_date == 'today':
+        config_end_date = today.strftime("%Y-%m-%d")
+
+    max_concurrent_listings = max(1, int(config.get('max_concurrent_listings', 1)))
+
+    # Which files to download, critical small artifacts first
+    rules = load_download_rules(config)
+
+    # Incremental mode starts from the last fully-synced date instead of config['start_date']
+    incremental = config.get('incremental', False)
+    high_water_mark_key = f"high_water_mark:{user_id}"
+    advance_high_water_mark = incremental
+    if incremental:
+        high_water_mark = manifest.get_state(high_water_mark_key)
+        if high_water_mark:
+            # Re-list a few days before the mark to catch recordings that finished processing late
+            overlap_days = config.get('incremental_overlap_days', 3)
+            resume_date = (datetime.datetime.strptime(high_water_mark, "%Y-%m-%d") - datetime.timedelta(days=overlap_days)).strftime("%Y-%m-%d")
+            start_date = max(start_date, resume_date)
+            print(f"Incremental sync of {user_id}: last fully-synced date is {high_water_mark}, starting from {start_date}")
+
+    # Windows are listed to the end as soon as they start, so page tokens never expire
+    # while the downloads catch up; only this many windows are listed ahead of the one
+    # being queued for download, which bounds the pages held in memory
+    listing_windows_ahead = max(1, int(config.get('listing_windows_ahead', max_concurrent_listings)))
+
+    # List month windows concurrently and stream their pages into the download pool
+    windows = month_windows(start_date, config_end_date)
+    engine = open_engine(config)
+    download_pool = engine.download_pool(manifest)
+    listings = iter_window_listings(engine, windows, user_id, listing_windows_ahead)
+    pending_windows = []
+    planning_failures = 0
+    listing_failures = 0
+    try:
+        for window_start, window_end, pages, listing_future in listings:
             # Print statement for clarity during testing
-            print(f"Fetching recordings from {start_date} to {end_date}")
+            print(f"Fetching recordings of {user_id} from {window_start} to {window_end}")
+
+            # Create folders and queue the files of each page as soon as it is listed
+            futures = []
+            failed_files = 0
+            meeting_count = 0
+            for meetings in pages:
+                meeting_count += len(meetings)
+                jobs, page_failures = plan_downloads(meetings, base_dir, manifest=manifest, rules=rules)
+                failed_files += page_failures
+                futures.extend(download_pool.submit(jobs))
+            listing_complete = listing_future.result()
+            planning_failures += failed_files
+            if not listing_complete:
+                print(f"Listing of {user_id} from {window_start} to {window_end} was incomplete, recordings may be missing")
+                logging.warning(f"Listing of {user_id} from {window_start} to {window_end} was incomplete")
+                listing_failures += 1
 
-            recordings_data = fetch_recordings(start_date, end_date)
-            
             # No recordings found for this period but continue to the next month
-            if not recordings_data:
-                print(f"No recordings found from {start_date} to {end_date}, moving to the next month.")
-                start_date = (datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-                if start_date > config_end_date:  # Break if we're past the config's end_date
-                    break
-                continue
-
-            # Create folders and download files while preserving structure
-            print("Starting folder creation and download process...")
-            create_folders_and_download(recordings_data, base_dir, ACCESS_TOKEN)
-            print("Folder creation and download completed.")
+            if not meeting_count:
+                print(f"No recordings found from {window_start} to {window_end}, moving to the next month.")
+
+            if advance_high_water_mark:
+                pending_windows.append((window_end, listing_complete, failed_files, futures))
+                advance_high_water_mark = _advance_high_water_mark(manifest, high_water_mark_key, pending_windows, today.strftime("%Y-%m-%d"))
+
+        if advance_high_water_mark:
+            _advance_high_water_mark(manifest, high_water_mark_key, pending_windows, today.strftime("%Y-%m-%d"), wait=True)
+    except BaseException:
+        # Do not keep downloading the queued files after an error or Ctrl-C
+        download_pool.abort()
+        raise
+    finally:
+        listings.close()
+        try:
+            download_pool.close()
+        finally:
+            engine.close()
+        print("Folder creation and download completed.")
+    return download_pool.downloaded_files, download_pool.failed_files + planning_failures + listing_failures, download_pool.total_bytes
+
+def list_users(status='active'):
+    """Return every user of the account with the given status, as returned by GET /users."""
+    url = f"{ZOOM_API_BASE_URL}/users"
+    params = {"status": status, "page_size": 300}
+    users = []
+    while True:
+        old_token = TOKENS.get_token()
+        response = SCHEDULER.get(url, headers={"Authorization": f"Bearer {old_token}"}, params=params)
+        if response.status_code == 401:
+            METRICS.incr('http_401', endpoint='users')
+            print("Access token invalid, refreshing...")
+            new_token = refresh_access_token(stale_token=old_token)
+            response = SCHEDULER.get(url, headers={"Authorization": f"Bearer {new_token}"}, params=params)
+        if response.status_code != 200:
+            raise RuntimeError(f"Error listing users: {response.status_code} {response.text}")
+
+        data = response.json()
+        users.extend(data.get('users', []))
+        if not data.get('next_page_token'):
+            return users
+        params['next_page_token'] = data['next_page_token']
+
+def select_shard(user_ids, shard_index=0, shard_count=1):
+    """Return the user_ids that belong to shard shard_index (0-based) of shard_count.
+
+    Users are assigned by a hash of their id, so every machine computes the same
+    split and users keep their shard when others join or leave the account.
+    """
+    return [user_id for user_id in user_ids
+            if int(hashlib.sha1(user_id.encode()).hexdigest(), 16) % shard_count == shard_index]
+
+def _init_user_process(config, processes=1):
+    configure_requests(config)
+    configure_downloads(config, processes=processes)
+    configure_metrics(config)
+
+def _backup_user_process(config, user_id):
+    # Runs in a worker process of backup_account, each user has its own manifest
+    manifest = open_manifest(config, user_id=user_id)
+    try:
+        return backup_user(config, user_id, manifest)
+    except Exception as e:
+        print(f"Backup of user {user_id} failed: {e}")
+        logging.error(f"Backup of user {user_id} failed: {e}", exc_info=True)
+        return None
+    finally:
+        manifest.close()
+
+def _backup_user_in_worker(config, user_id):
+    # Worker processes hand their metrics back to the parent with the result
+    METRICS.reset()
+    result = _backup_user_process(config, user_id)
+    return result, METRICS.snapshot()
+
+def backup_account(config):
+    """Back up every user of the account, or of this machine's shard of it.
+
+    Users are spread over user_processes worker processes. shard_index and
+    shard_count split the account between several machines. Returns
+    {user_id: backup_user result}, None for users whose backup raised or whose
+    worker process died.
+    """
+    shard_index = int(config.get('shard_index', 0))
+    shard_count = int(config.get('shard_count', 1))
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index must be between 0 and {shard_count - 1}, got {shard_index}")
+    user_processes = max(1, int(config.get('user_processes', 1)))
+
+    _init_user_process(config)
+    refresh_access_token()
+
+    users = list_users(config.get('user_status', 'active'))
+    user_ids = select_shard(sorted(user['id'] for user in users), shard_index, shard_count)
+    print(f"Account backup: {len(user_ids)} of {len(users)} users in shard {shard_index + 1}/{shard_count}, {user_processes} processes")
+
+    results = {}
+    if user_processes == 1:
+        for user_id in user_ids:
+            results[user_id] = _backup_user_process(config, user_id)
+    else:
+        # Zoom's API rate limits apply to the whole account, so the processes split the budget
+        process_config = dict(config)
+        api_requests_per_second = config.get('api_requests_per_second', config.get('listing_requests_per_second', None))
+        if api_requests_per_second:
+            process_config['api_requests_per_second'] = api_requests_per_second / user_processes
+        with ProcessPoolExecutor(max_workers=user_processes, initializer=_init_user_process, initargs=(process_config, user_processes)) as executor:
+            futures = {executor.submit(_backup_user_in_worker, process_config, user_id): user_id for user_id in user_ids}
+            for future in as_completed(futures):
+                user_id = futures[future]
+                try:
+                    results[user_id], worker_metrics = future.result()
+                except Exception as e:
+                    # The worker process died (BrokenProcessPool) or its result could not be sent back
+                    print(f"Backup of user {user_id} failed: {e!r}")
+                    logging.error(f"Backup of user {user_id} failed: {e!r}", exc_info=True)
+                    results[user_id] = None
+                    continue
+                METRICS.merge(worker_metrics)
+
+    failed_users = sorted(user_id for user_id, result in results.items() if result is None or result[1])
+    downloaded_files = sum(result[0] for result in results.values() if result)
+    total_bytes = sum(result[2] for result in results.values() if result)
+    message = f"Account backup finished: {len(user_ids) - len(failed_users)} users complete, {downloaded_files} files, {total_bytes} bytes"
+    if failed_users:
+        message += f", incomplete users: {', '.join(failed_users)}"
+    print(message)
+    logging.info(message)
+    return results
+
+def run_backup(config):
+    """Run the configured backup. Returns True if every file and listing succeeded."""
+    # Account-wide mode backs up every user of the account into base_dir/<user_id>
+    if config.get('all_users', False):
+        results = backup_account(config)
+        return not any(result is None or result[1] for result in results.values())
+
+    if not USER_ID:
+        raise ValueError("USER_ID must be set in .env unless all_users is enabled in the configuration.")
+
+    # Listing concurrency, rate budget and download buffers
+    configure_requests(config)
+    configure_downloads(config)
+
+    # Local record of completed files so reruns skip them
+    manifest = open_manifest(config)
+
+    # Initial access token refresh
+    refresh_access_token()
+
+    check_zoom_rate_limits()
+
+    _, failed_files, _ = backup_user(config, USER_ID, manifest)
+    return not failed_files
 
-            # Move to the next month
-            start_date = (datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+def main():
+    require_credentials(user_id_required=False)
+    try:
+        config = load_config()
 
-            # Break if we've passed the final end_date from the config
-            if start_date > config_end_date:
-                break
+        # Structured metrics (metrics_path, metrics_prometheus_path) and an opt-in cProfile run (profile_path)
+        configure_metrics(config)
+        METRICS.reset()
+        with profiled(config.get('profile_path', None)):
+            try:
+                complete = run_backup(config)
+            finally:
+                report_connection_stats()
+                METRICS.report()
         
-        print("All recordings processed and uploaded successfully.")
+        if complete:
+            print("All recordings processed and uploaded successfully.")
+        else:
+            print("Backup finished with failed downloads or incomplete listings, run it again to retry them.")
+            logging.warning("Backup finished with failed downloads or incomplete listings")
     except Exception as e:
         print(f"An error occurred: {e}")
         logging.error(f"An error occurred: {e}", exc_info=True)